@@ -0,0 +1,7 @@
+"""
+Outils de mesure de performance (100 % hors-ligne).
+
+À lancer depuis le dossier BackEnd, par exemple :
+    python -m bench.run --users 50 --messages 200 --concurrency 20 --output avant.json
+    python -m bench.llm_pool
+"""
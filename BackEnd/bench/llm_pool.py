@@ -0,0 +1,114 @@
+"""
+Mesure de call_openrouter sous charge concurrente, contre le faux serveur local.
+
+Compare :
+- "pooled"      : client partagé de llm.py (keep-alive, pool, retries)
+- "per_request" : un nouvel httpx.AsyncClient par appel (ancien comportement)
+
+Usage (depuis BackEnd) :
+    python -m bench.llm_pool --requests 500 --concurrency 50 --latency 0.05
+
+Le résultat est écrit en JSON sur la sortie standard (p50/p99 par mode).
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Awaitable, Callable, List
+
+import httpx
+
+import llm
+from bench.stats import summarize
+from bench.stub_openrouter import StubConfig, StubOpenRouter
+
+MESSAGES = [
+    {"role": "system", "content": "Tu es un assistant utile et concis."},
+    {"role": "user", "content": "Bonjour !"},
+]
+
+
+async def _drive(call: Callable[[], Awaitable[object]], requests: int, concurrency: int) -> dict:
+    latencies: List[float] = []
+    errors = 0
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one() -> None:
+        nonlocal errors
+        async with sem:
+            start = time.perf_counter()
+            try:
+                await call()
+            except RuntimeError:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return summarize(latencies, time.perf_counter() - start, errors)
+
+
+async def _per_request_call() -> str:
+    headers, payload = llm._build_request(MESSAGES, stream=False)
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        resp = await client.post(llm._openrouter_url(), headers=headers, json=payload)
+    if resp.status_code != 200:
+        raise RuntimeError(f"OpenRouter error: {resp.status_code}")
+    return resp.json()["choices"][0]["message"]["content"]
+
+
+async def run(requests: int, concurrency: int, stub: StubOpenRouter) -> dict:
+    results = {}
+
+    connections_before = stub.connections
+    results["per_request"] = await _drive(_per_request_call, requests, concurrency)
+    results["per_request"]["upstream_connections"] = stub.connections - connections_before
+
+    await llm.open_client()
+    try:
+        connections_before = stub.connections
+        results["pooled"] = await _drive(lambda: llm.call_openrouter(MESSAGES), requests, concurrency)
+        results["pooled"]["upstream_connections"] = stub.connections - connections_before
+    finally:
+        await llm.close_client()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark du client OpenRouter partagé")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    stub = StubOpenRouter(StubConfig(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        seed=args.seed,
+    )).start_in_thread()
+
+    os.environ["OPENROUTER_URL"] = stub.url
+    os.environ.setdefault("OPENROUTER_API_KEY", "bench")
+    os.environ.setdefault("OPENROUTER_RETRY_BASE_DELAY", "0.05")
+
+    try:
+        results = asyncio.run(run(args.requests, args.concurrency, stub))
+    finally:
+        stub.stop_thread()
+
+    report = {
+        "benchmark": "llm_pool",
+        "params": vars(args),
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
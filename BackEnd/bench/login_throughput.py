@@ -0,0 +1,84 @@
+"""
+Débit de vérification de mot de passe (login) selon la taille du pool bcrypt.
+
+Pour chaque taille de pool, on lance --requests vérifications avec
+--concurrency requêtes simultanées et on mesure débit, p50/p95/p99 et
+nombre de refus (file pleine => 503 côté API).
+
+Usage (depuis BackEnd) :
+    python -m bench.login_throughput --pool-sizes 1 2 4 8 --rounds 10
+
+Résultat en JSON sur la sortie standard.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import List
+
+import bcrypt
+
+from bench.stats import summarize
+from security import PasswordHasher, PasswordHasherBusy
+
+PASSWORD = "correct horse battery staple"
+
+
+async def run_pool(pool_size: int, max_pending: int, requests: int, concurrency: int, password_hash: str) -> dict:
+    hasher = PasswordHasher(max_workers=pool_size, max_pending=max_pending)
+    latencies: List[float] = []
+    rejected = 0
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one() -> None:
+        nonlocal rejected
+        async with sem:
+            start = time.perf_counter()
+            try:
+                ok = await hasher.verify(PASSWORD, password_hash)
+            except PasswordHasherBusy:
+                rejected += 1
+                return
+            assert ok
+            latencies.append(time.perf_counter() - start)
+
+    try:
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        elapsed = time.perf_counter() - start
+    finally:
+        hasher.shutdown()
+
+    result = summarize(latencies, elapsed, errors=rejected)
+    result["rejected_503"] = result.pop("errors")
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark du pool bcrypt (login)")
+    parser.add_argument("--pool-sizes", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 4])
+    parser.add_argument("--rounds", type=int, default=12, help="coût bcrypt des hash vérifiés")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--max-pending", type=int, default=64)
+    args = parser.parse_args()
+
+    password_hash = bcrypt.hashpw(PASSWORD.encode("utf-8"), bcrypt.gensalt(rounds=args.rounds)).decode("utf-8")
+
+    results = {}
+    for size in args.pool_sizes:
+        results[f"pool_{size}"] = asyncio.run(
+            run_pool(size, args.max_pending, args.requests, args.concurrency, password_hash)
+        )
+
+    print(json.dumps({
+        "benchmark": "login_throughput",
+        "params": vars(args),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+"""
+Benchmark de bout en bout de l'API, 100 % hors-ligne.
+
+1. remplit un dossier BDD jetable (N utilisateurs, M messages chacun)
+2. démarre le faux OpenRouter (bench.stub_openrouter) dans un processus
+3. démarre l'API (uvicorn main:app) dans un autre processus, pointée sur
+   ce dossier et sur le faux OpenRouter
+4. enchaîne les phases register / login / chat / chat_stream / history
+   avec --concurrency requêtes simultanées
+5. écrit un rapport JSON (débit, p50/p95/p99 par endpoint) à comparer
+   d'une exécution à l'autre
+
+Usage (depuis BackEnd) :
+    python -m bench.run --users 50 --messages 200 --requests 200 --concurrency 20
+    python -m bench.run --env HISTORY_BACKEND=sqlite --output sqlite.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Union
+
+import httpx
+
+from bench.seed import BENCH_PASSWORD, bench_email, seed
+from bench.stats import summarize
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+PHASES = ("register", "login", "chat", "chat_stream", "history")
+
+
+class Recorder:
+    """Latences et codes HTTP par endpoint."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.statuses: Dict[str, Counter] = {}
+        self.elapsed: Dict[str, float] = {}
+
+    def add(self, endpoint: str, status: Union[int, str], latency: float) -> None:
+        """status : code HTTP, ou "sse_error" pour un flux 200 en échec (event: error, pas de done)."""
+        self.statuses.setdefault(endpoint, Counter())[str(status)] += 1
+        if isinstance(status, int) and 200 <= status < 300:
+            self.latencies.setdefault(endpoint, []).append(latency)
+
+    def report(self) -> Dict[str, dict]:
+        results = {}
+        for endpoint, statuses in self.statuses.items():
+            ok = self.latencies.get(endpoint, [])
+            errors = sum(statuses.values()) - len(ok)
+            summary = summarize(ok, self.elapsed.get(endpoint, 0.0), errors)
+            summary["status_codes"] = dict(sorted(statuses.items()))
+            results[endpoint] = summary
+        return results
+
+
+# ==========
+# PROCESSUS (faux OpenRouter + API)
+# ==========
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _start(cmd: List[str], env: Dict[str, str], log_path: Path) -> subprocess.Popen:
+    # Le processus fils garde sa propre copie du descripteur : on peut fermer la nôtre
+    with open(log_path, "wb") as log:
+        return subprocess.Popen(cmd, cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def _stop(proc: subprocess.Popen) -> None:
+    if proc.poll() is None:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def _wait_ready(url: str, proc: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Process exited early ({proc.returncode}), see logs")
+        try:
+            with socket.create_connection(_host_port(url), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Timeout waiting for {url}")
+
+
+def _host_port(url: str):
+    parsed = httpx.URL(url)
+    return parsed.host, parsed.port
+
+
+# ==========
+# CHARGE
+# ==========
+async def _drive(
+    recorder: Recorder,
+    phase: str,
+    requests: int,
+    concurrency: int,
+    one: Callable[[int], Awaitable[None]],
+) -> None:
+    sem = asyncio.Semaphore(concurrency)
+
+    async def guarded(i: int) -> None:
+        async with sem:
+            await one(i)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(guarded(i) for i in range(requests)))
+    elapsed = time.perf_counter() - start
+    for endpoint in list(recorder.statuses):
+        if endpoint == phase or endpoint.startswith(f"{phase}_"):
+            recorder.elapsed[endpoint] = elapsed
+
+
+async def _timed(recorder: Recorder, endpoint: str, request: Awaitable[httpx.Response]) -> Optional[httpx.Response]:
+    start = time.perf_counter()
+    try:
+        resp = await request
+    except httpx.HTTPError:
+        recorder.add(endpoint, 0, time.perf_counter() - start)
+        return None
+    recorder.add(endpoint, resp.status_code, time.perf_counter() - start)
+    return resp
+
+
+async def run_load(base_url: str, args: argparse.Namespace) -> Recorder:
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120.0) as client:
+        tokens: List[str] = []
+        phases = args.phases
+
+        if "register" in phases:
+            async def register(i: int) -> None:
+                params = {"email": f"new{i}@example.com", "password": BENCH_PASSWORD}
+                await _timed(recorder, "register", client.post("/auth/register", params=params))
+
+            await _drive(recorder, "register", args.requests, args.concurrency, register)
+
+        # Les phases suivantes ont besoin de tokens : login sur les comptes créés par seed
+        needs_tokens = any(p in phases for p in ("chat", "chat_stream", "history"))
+        if "login" in phases or needs_tokens:
+            login_requests = args.requests if "login" in phases else min(args.users, args.concurrency)
+
+            async def login(i: int) -> None:
+                params = {"email": bench_email(i % args.users), "password": BENCH_PASSWORD}
+                resp = await _timed(recorder, "login", client.post("/auth/login", params=params))
+                if resp is not None and resp.status_code == 200 and len(tokens) < args.users:
+                    tokens.append(resp.json()["access_token"])
+
+            await _drive(recorder, "login", login_requests, args.concurrency, login)
+            if "login" not in phases:
+                recorder.statuses.pop("login", None)
+                recorder.latencies.pop("login", None)
+                recorder.elapsed.pop("login", None)
+
+        if needs_tokens and not tokens:
+            raise RuntimeError("No access token obtained, cannot run authenticated phases")
+
+        def auth(i: int) -> Dict[str, str]:
+            return {"Authorization": f"Bearer {tokens[i % len(tokens)]}"}
+
+        if "chat" in phases:
+            async def chat(i: int) -> None:
+                params = {"message": f"Question de test n°{i}"}
+                await _timed(recorder, "chat", client.post("/ai/chat", params=params, headers=auth(i)))
+
+            await _drive(recorder, "chat", args.requests, args.concurrency, chat)
+
+        if "chat_stream" in phases:
+            async def chat_stream(i: int) -> None:
+                params = {"message": f"Question de test (stream) n°{i}"}
+                start = time.perf_counter()
+                first_token = None
+                events = set()
+                try:
+                    async with client.stream("POST", "/ai/chat/stream", params=params, headers=auth(i)) as resp:
+                        async for line in resp.aiter_lines():
+                            if not line.startswith("event: "):
+                                continue
+                            event = line[len("event: "):]
+                            events.add(event)
+                            if first_token is None and event == "delta":
+                                first_token = time.perf_counter() - start
+                        status = resp.status_code
+                except httpx.HTTPError:
+                    status = 0
+                # Les erreurs OpenRouter arrivent dans un flux HTTP 200 : on lit les évènements
+                if status == 200 and ("error" in events or "done" not in events):
+                    status = "sse_error"
+                total = time.perf_counter() - start
+                recorder.add("chat_stream", status, total)
+                # Temps avant le premier morceau : la latence que l'utilisateur perçoit
+                if first_token is not None:
+                    recorder.add("chat_stream_ttft", status, first_token)
+
+            await _drive(recorder, "chat_stream", args.requests, args.concurrency, chat_stream)
+
+        if "history" in phases:
+            async def history(i: int) -> None:
+                params = {"limit": 50, "order": "desc"}
+                resp = await _timed(recorder, "history", client.get("/history", params=params, headers=auth(i)))
+                cursor = resp.json().get("next_cursor") if resp is not None and resp.status_code == 200 else None
+                if cursor:
+                    params["cursor"] = cursor
+                    await _timed(recorder, "history_next", client.get("/history", params=params, headers=auth(i)))
+
+            await _drive(recorder, "history", args.requests, args.concurrency, history)
+
+    return recorder
+
+
+# ==========
+# RAPPORT
+# ==========
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, timeout=5
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def _parse_env(pairs: List[str]) -> Dict[str, str]:
+    env = {}
+    for pair in pairs:
+        key, sep, value = pair.partition("=")
+        if not sep:
+            raise SystemExit(f"--env expects KEY=VALUE, got {pair!r}")
+        env[key] = value
+    return env
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de bout en bout de l'API (hors-ligne)")
+    parser.add_argument("--users", type=int, default=50, help="utilisateurs pré-créés")
+    parser.add_argument("--messages", type=int, default=100, help="messages d'historique par utilisateur")
+    parser.add_argument("--requests", type=int, default=200, help="requêtes par phase")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--phases", nargs="+", choices=PHASES, default=list(PHASES))
+    parser.add_argument("--bcrypt-rounds", type=int, default=10, help="coût bcrypt des comptes (et de l'API)")
+    # Faux OpenRouter
+    parser.add_argument("--latency", type=float, default=0.2, help="secondes avant la réponse du modèle")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="secondes entre deux morceaux (stream)")
+    parser.add_argument("--tokens", type=int, default=30, help="morceaux par réponse")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--seed", type=int, default=1)
+    # API
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="variable d'environnement de l'API (ex : HISTORY_BACKEND=sqlite)")
+    parser.add_argument("--data-dir", type=Path, default=None, help="dossier BDD (défaut : dossier temporaire)")
+    parser.add_argument("--keep-data", action="store_true")
+    parser.add_argument("--output", type=Path, default=None, help="fichier JSON (défaut : sortie standard)")
+    args = parser.parse_args()
+
+    overrides = _parse_env(args.env)
+    data_dir = args.data_dir or Path(tempfile.mkdtemp(prefix="assistantia-bench-"))
+
+    # Même configuration pour l'API et pour le remplissage (backend d'historique...)
+    app_env = dict(os.environ)
+    app_env.update({
+        "BDD_DIR": str(data_dir),
+        "OPENROUTER_API_KEY": "bench",
+        "BCRYPT_ROUNDS": str(args.bcrypt_rounds),
+        # Le benchmark mesure l'API, pas les limites : désactivées sauf demande contraire
+        "RATE_LIMIT_ENABLED": "0",
+    })
+    app_env.update(overrides)
+
+    stub_port, app_port = _free_port(), _free_port()
+    app_env["OPENROUTER_URL"] = f"http://127.0.0.1:{stub_port}/api/v1/chat/completions"
+
+    previous_env = dict(os.environ)
+    os.environ.update({k: v for k, v in app_env.items() if k in ("HISTORY_BACKEND", "HISTORY_SQLITE_PATH")})
+    try:
+        seed_start = time.perf_counter()
+        seed(data_dir, args.users, args.messages, args.bcrypt_rounds)
+        seed_seconds = time.perf_counter() - seed_start
+    finally:
+        os.environ.clear()
+        os.environ.update(previous_env)
+
+    stub = _start(
+        [sys.executable, "-m", "bench.stub_openrouter", "--port", str(stub_port),
+         "--latency", str(args.latency), "--token-delay", str(args.token_delay), "--tokens", str(args.tokens),
+         "--error-rate", str(args.error_rate), "--error-status", str(args.error_status), "--seed", str(args.seed)],
+        app_env, data_dir / "stub.log",
+    )
+    app = None
+    try:
+        _wait_ready(app_env["OPENROUTER_URL"], stub)
+        app = _start(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(app_port),
+             "--log-level", "warning"],
+            app_env, data_dir / "api.log",
+        )
+        base_url = f"http://127.0.0.1:{app_port}"
+        _wait_ready(base_url, app)
+
+        start = time.perf_counter()
+        recorder = asyncio.run(run_load(base_url, args))
+        total_seconds = time.perf_counter() - start
+    finally:
+        if app is not None:
+            _stop(app)
+        _stop(stub)
+        if not args.keep_data and args.data_dir is None:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    params = {k: (str(v) if isinstance(v, Path) else v) for k, v in vars(args).items() if k != "env"}
+    report = {
+        "benchmark": "api",
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "params": params,
+        "env": overrides,
+        "seed_seconds": round(seed_seconds, 2),
+        "total_seconds": round(total_seconds, 2),
+        "results": recorder.report(),
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        args.output.write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
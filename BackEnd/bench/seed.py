@@ -0,0 +1,84 @@
+"""
+Remplit un dossier BDD jetable : N utilisateurs et M messages par utilisateur.
+
+Tous les comptes ont le même mot de passe (BENCH_PASSWORD) : le hash bcrypt
+n'est calculé qu'une fois. L'historique passe par storage.open_history_store,
+donc par le backend choisi avec HISTORY_BACKEND.
+"""
+import argparse
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List
+
+import bcrypt
+from tinydb import TinyDB
+
+from storage import open_history_store
+
+BENCH_PASSWORD = "bench-password"
+_BATCH = 5000
+
+
+def bench_email(i: int) -> str:
+    return f"bench{i}@example.com"
+
+
+def seed(data_dir: Path, users: int, messages_per_user: int, bcrypt_rounds: int = 12) -> List[Dict[str, str]]:
+    """Crée les données et retourne les fiches utilisateurs créées."""
+    data_dir.mkdir(parents=True, exist_ok=True)
+    password_hash = bcrypt.hashpw(BENCH_PASSWORD.encode("utf-8"), bcrypt.gensalt(rounds=bcrypt_rounds)).decode("utf-8")
+
+    start = datetime.now(timezone.utc) - timedelta(days=30)
+    docs = [
+        {
+            "id": f"usr_{uuid.uuid4().hex}",
+            "email": bench_email(i),
+            "password_hash": password_hash,
+            "created_at": start.isoformat(),
+        }
+        for i in range(users)
+    ]
+    # Une seule écriture du fichier users.json
+    db = TinyDB(data_dir / "users.json")
+    try:
+        db.table("dbuser").insert_multiple(docs)
+    finally:
+        db.close()
+
+    store = open_history_store(data_dir)
+    try:
+        batch = []
+        for doc in docs:
+            for j in range(messages_per_user):
+                batch.append({
+                    "id": f"msg_{uuid.uuid4().hex}",
+                    "user_id": doc["id"],
+                    "role": "user" if j % 2 == 0 else "assistant",
+                    "content": f"Message de test n°{j} " + "lorem ipsum " * 8,
+                    "created_at": (start + timedelta(seconds=j)).isoformat(),
+                })
+                if len(batch) >= _BATCH:
+                    store.add_many(batch)
+                    batch = []
+        if batch:
+            store.add_many(batch)
+    finally:
+        store.close()
+    return docs
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Remplit un dossier BDD de test")
+    parser.add_argument("data_dir", type=Path)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=100, help="messages par utilisateur")
+    parser.add_argument("--bcrypt-rounds", type=int, default=int(os.getenv("BCRYPT_ROUNDS", "12")))
+    args = parser.parse_args()
+    seed(args.data_dir, args.users, args.messages, args.bcrypt_rounds)
+    print(f"{args.users} utilisateurs, {args.users * args.messages} messages dans {args.data_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""Petits calculs statistiques partagés par les benchmarks."""
+import math
+from typing import Dict, List
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Percentile par la méthode "nearest rank" (valeurs déjà triées)."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies: List[float], elapsed: float, errors: int = 0) -> Dict[str, float]:
+    """
+    Résumé d'une série de mesures (latences en secondes, durée totale en secondes).
+    Les latences sont rendues en millisecondes pour la lisibilité du JSON.
+    """
+    values = sorted(latencies)
+    count = len(values)
+    return {
+        "requests": count + errors,
+        "errors": errors,
+        "throughput_rps": round(count / elapsed, 2) if elapsed > 0 else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 2),
+        "p95_ms": round(percentile(values, 95) * 1000, 2),
+        "p99_ms": round(percentile(values, 99) * 1000, 2),
+        "max_ms": round(values[-1] * 1000, 2) if values else 0.0,
+    }
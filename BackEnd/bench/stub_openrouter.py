@@ -0,0 +1,222 @@
+"""
+Faux serveur OpenRouter (HTTP/1.1, keep-alive) pour les benchmarks.
+
+Il imite l'endpoint /api/v1/chat/completions :
+- mode classique (JSON) et mode streaming (SSE "data: ...", puis "data: [DONE]")
+- latence avant le premier octet et délai entre les morceaux configurables
+- taux d'erreurs configurable (429 avec Retry-After, ou 5xx)
+
+Aucune dépendance : uniquement asyncio, pour que les mesures ne dépendent
+pas du réseau ni d'un service externe.
+
+Usage autonome :
+    python -m bench.stub_openrouter --port 8099 --latency 0.2
+"""
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+
+@dataclass
+class StubConfig:
+    latency: float = 0.05        # secondes avant la réponse (ou le premier morceau)
+    token_delay: float = 0.005   # secondes entre deux morceaux en streaming
+    tokens: int = 20             # nombre de morceaux générés
+    error_rate: float = 0.0      # proportion de requêtes en erreur (0..1)
+    error_status: int = 503      # code renvoyé pour une erreur (429 => Retry-After)
+    retry_after: float = 0.05    # valeur de Retry-After pour les 429
+    seed: Optional[int] = None
+
+
+class StubOpenRouter:
+    """Serveur asyncio minimal ; compte les connexions pour vérifier le keep-alive."""
+
+    def __init__(self, config: Optional[StubConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or StubConfig()
+        self.host = host
+        self.port = port
+        self.connections = 0
+        self.requests = 0
+        self._rng = random.Random(self.config.seed)
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}/api/v1/chat/completions"
+
+    # ---------- cycle de vie ----------
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def start_in_thread(self) -> "StubOpenRouter":
+        """
+        Démarre le serveur dans sa propre boucle, sur un thread séparé,
+        pour que le serveur ne partage pas la boucle du client mesuré.
+        """
+        ready = threading.Event()
+
+        def run() -> None:
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.start())
+            ready.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self.stop())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name="stub-openrouter", daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop_thread(self) -> None:
+        if self._loop is not None and self._thread is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+            self._thread = None
+
+    # ---------- HTTP ----------
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Tuple[str, dict, bytes]]:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+        lines = head.decode("latin-1").split("\r\n")
+        request_line = lines[0]
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", "0"))
+        body = await reader.readexactly(length) if length else b""
+        return request_line, headers, body
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                _, headers, body = request
+                self.requests += 1
+                await self._respond(writer, body)
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer: asyncio.StreamWriter, body: bytes) -> None:
+        cfg = self.config
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            payload = {}
+        model = payload.get("model", "stub/model")
+
+        await asyncio.sleep(cfg.latency)
+
+        if cfg.error_rate and self._rng.random() < cfg.error_rate:
+            extra = f"Retry-After: {cfg.retry_after}\r\n" if cfg.error_status == 429 else ""
+            data = json.dumps({"error": {"code": cfg.error_status, "message": "stub error"}}).encode()
+            writer.write(
+                f"HTTP/1.1 {cfg.error_status} Error\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(data)}\r\n{extra}\r\n".encode() + data
+            )
+            await writer.drain()
+            return
+
+        words = [f"mot{i} " for i in range(cfg.tokens)]
+        usage = {
+            "prompt_tokens": sum(len(str(m.get("content", ""))) // 4 for m in payload.get("messages", [])),
+            "completion_tokens": cfg.tokens,
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        if not payload.get("stream"):
+            data = json.dumps({
+                "id": f"gen-{time.time_ns()}",
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(words)},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            }).encode()
+            writer.write(
+                f"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n".encode()
+                + data
+            )
+            await writer.drain()
+            return
+
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n"
+        )
+        self._write_chunk(writer, b": OPENROUTER PROCESSING\n\n")
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(cfg.token_delay)
+            chunk = {"model": model, "choices": [{"index": 0, "delta": {"content": word}}]}
+            self._write_chunk(writer, f"data: {json.dumps(chunk)}\n\n".encode())
+            await writer.drain()
+        final = {"model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}
+        self._write_chunk(writer, f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode())
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    @staticmethod
+    def _write_chunk(writer: asyncio.StreamWriter, data: bytes) -> None:
+        writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Faux serveur OpenRouter local")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=StubConfig.latency)
+    parser.add_argument("--token-delay", type=float, default=StubConfig.token_delay)
+    parser.add_argument("--tokens", type=int, default=StubConfig.tokens)
+    parser.add_argument("--error-rate", type=float, default=StubConfig.error_rate)
+    parser.add_argument("--error-status", type=int, default=StubConfig.error_status)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    config = StubConfig(
+        latency=args.latency,
+        token_delay=args.token_delay,
+        tokens=args.tokens,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        seed=args.seed,
+    )
+    stub = StubOpenRouter(config, host=args.host, port=args.port)
+
+    async def serve() -> None:
+        await stub.start()
+        print(f"Stub OpenRouter prêt : {stub.url}")
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
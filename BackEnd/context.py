@@ -0,0 +1,254 @@
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from llm import call_openrouter
+from storage import Cursor, HistoryStore
+
+logger = logging.getLogger(__name__)
+
+# ==========
+# CONFIG
+# ==========
+# Taille max du prompt envoyé au modèle (estimée, en tokens). 0 = pas d'historique.
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "3000"))
+# Quand la fenêtre déborde, on ne garde que cette fraction du budget en messages
+# récents : le résumé n'est recalculé qu'après plusieurs nouveaux échanges.
+CONTEXT_RETAIN_RATIO = float(os.getenv("CONTEXT_RETAIN_RATIO", "0.6"))
+# Taille max du résumé, et du texte envoyé pour le produire
+CONTEXT_SUMMARY_MAX_TOKENS = int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", "400"))
+CONTEXT_SUMMARY_INPUT_TOKENS = int(os.getenv("CONTEXT_SUMMARY_INPUT_TOKENS", "3000"))
+# Nombre d'utilisateurs dont le résumé est gardé en mémoire
+CONTEXT_SUMMARY_CACHE_SIZE = int(os.getenv("CONTEXT_SUMMARY_CACHE_SIZE", "1000"))
+
+# Messages lus par page dans l'historique (du plus récent au plus ancien)
+_PAGE_SIZE = 20
+# Surcoût approximatif de chaque message (rôle, séparateurs)
+_MESSAGE_OVERHEAD = 4
+
+SUMMARY_PROMPT = (
+    "Tu résumes une conversation entre un utilisateur et un assistant. "
+    "Conserve les faits, préférences et questions encore ouvertes. "
+    "Réponds uniquement par le résumé, en quelques phrases."
+)
+
+
+class SummaryPostponed(Exception):
+    """Le résumé ne peut pas être calculé maintenant (ex : plus de place vers OpenRouter)."""
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimation rapide du nombre de tokens, sans tokenizer :
+    ~4 caractères par token, et au moins un token par mot.
+    """
+    return max(len(text) // 4, len(text.split())) + 1
+
+
+def message_tokens(message: Dict[str, str]) -> int:
+    return estimate_tokens(message["content"]) + _MESSAGE_OVERHEAD
+
+
+def _key(item: Dict[str, str]) -> Cursor:
+    return item["created_at"], item["id"]
+
+
+@dataclass
+class _Summary:
+    boundary: Cursor  # (created_at, id) du message le plus récent déjà résumé
+    text: str
+
+
+async def summarize_turns(previous: str, turns: List[Dict[str, str]]) -> str:
+    """Résumé glissant : fusionne l'ancien résumé et les échanges sortis de la fenêtre."""
+    transcript = "\n".join(f"{t['role']}: {t['content']}" for t in turns)
+    return await call_openrouter([
+        {"role": "system", "content": SUMMARY_PROMPT},
+        {"role": "user", "content": f"Résumé existant :\n{previous or '(aucun)'}\n\nNouveaux échanges :\n{transcript}"},
+    ])
+
+
+class ContextBuilder:
+    """
+    Construit la liste de messages envoyée au modèle :
+    [system, résumé des anciens échanges, derniers échanges, nouveau message]
+
+    - Les derniers échanges sont lus page par page, du plus récent au plus
+      ancien, et seulement jusqu'à remplir le budget de tokens.
+    - Les échanges plus anciens sont remplacés par un résumé glissant,
+      gardé en cache par utilisateur.
+    - Le résumé n'est recalculé que quand la fenêtre déborde, dans une tâche
+      de fond : la requête en cours part avec le résumé précédent et n'attend
+      pas un second appel au modèle (temps avant le premier token inchangé).
+      Le nouveau résumé s'arrête avant une fenêtre réduite
+      (CONTEXT_RETAIN_RATIO) pour laisser de la marge aux échanges suivants.
+    """
+
+    def __init__(
+        self,
+        store: HistoryStore,
+        summarize: Callable[[str, List[Dict[str, str]]], Awaitable[str]] = summarize_turns,
+        max_tokens: int = CONTEXT_MAX_TOKENS,
+        retain_ratio: float = CONTEXT_RETAIN_RATIO,
+        summary_max_tokens: int = CONTEXT_SUMMARY_MAX_TOKENS,
+        summary_input_tokens: int = CONTEXT_SUMMARY_INPUT_TOKENS,
+        cache_size: int = CONTEXT_SUMMARY_CACHE_SIZE,
+    ):
+        self.store = store
+        self.summarize = summarize
+        self.max_tokens = max_tokens
+        self.retain_ratio = retain_ratio
+        self.summary_max_tokens = summary_max_tokens
+        self.summary_input_tokens = summary_input_tokens
+        self.cache_size = cache_size
+        self._summaries: "OrderedDict[str, _Summary]" = OrderedDict()
+        # Recalculs de résumé en cours (au plus un par utilisateur)
+        self._refreshing: Dict[str, asyncio.Task] = {}
+
+    def forget(self, user_id: str) -> None:
+        """À appeler quand l'historique d'un utilisateur est effacé."""
+        self._summaries.pop(user_id, None)
+        task = self._refreshing.pop(user_id, None)
+        if task is not None:
+            task.cancel()
+
+    async def wait_for_summaries(self) -> None:
+        """Attend la fin des recalculs de résumé en cours."""
+        while self._refreshing:
+            await asyncio.gather(*list(self._refreshing.values()), return_exceptions=True)
+
+    async def stop(self) -> None:
+        """Annule les recalculs en cours (appelé à l'arrêt) ; le résumé se refera au besoin."""
+        tasks = list(self._refreshing.values())
+        self._refreshing.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _cached_summary(self, user_id: str) -> Optional[_Summary]:
+        summary = self._summaries.get(user_id)
+        if summary is not None:
+            self._summaries.move_to_end(user_id)
+        return summary
+
+    def _store_summary(self, user_id: str, summary: _Summary) -> None:
+        self._summaries[user_id] = summary
+        self._summaries.move_to_end(user_id)
+        while len(self._summaries) > self.cache_size:
+            self._summaries.popitem(last=False)
+
+    async def _recent(self, user_id: str, budget: int, boundary: Optional[Cursor]) -> List[Dict[str, str]]:
+        """
+        Lit les messages plus récents que boundary, du plus récent au plus ancien,
+        jusqu'à dépasser budget tokens (lecture incrémentale, page par page).
+        """
+        items: List[Dict[str, str]] = []
+        total = 0
+        after: Optional[Cursor] = None
+        while True:
+            page = await asyncio.to_thread(
+                self.store.list_page, user_id, _PAGE_SIZE, after, True
+            )
+            for item in page:
+                if boundary is not None and _key(item) <= boundary:
+                    return items
+                items.append(item)
+                total += message_tokens(item)
+                if total > budget:
+                    return items
+            if len(page) < _PAGE_SIZE:
+                return items
+            after = _key(page[-1])
+
+    async def _oldest_unsummarized(
+        self, user_id: str, boundary: Optional[Cursor], upto: Cursor
+    ) -> List[Dict[str, str]]:
+        """
+        Messages qui suivent boundary, du plus ancien au plus récent, jusqu'à upto
+        (inclus) et dans la limite de summary_input_tokens (au moins un message,
+        pour toujours avancer).
+        """
+        turns: List[Dict[str, str]] = []
+        total = 0
+        after = boundary
+        while True:
+            page = await asyncio.to_thread(
+                self.store.list_page, user_id, _PAGE_SIZE, after, False
+            )
+            for item in page:
+                tokens = message_tokens(item)
+                if _key(item) > upto or (turns and total + tokens > self.summary_input_tokens):
+                    return turns
+                turns.append(item)
+                total += tokens
+            if len(page) < _PAGE_SIZE:
+                return turns
+            after = _key(page[-1])
+
+    async def build(self, user_id: str, system_prompt: str, message: str) -> List[Dict[str, str]]:
+        system = {"role": "system", "content": system_prompt}
+        new = {"role": "user", "content": message}
+        if self.max_tokens <= 0:
+            return [system, new]
+
+        summary = self._cached_summary(user_id)
+        fixed = message_tokens(system) + message_tokens(new)
+        budget = self.max_tokens - fixed - self.summary_max_tokens
+
+        recent = await self._recent(user_id, max(0, budget), summary.boundary if summary else None)
+        window = self._fit(recent, budget)
+
+        if len(window) < len(recent) and user_id not in self._refreshing:
+            # La fenêtre déborde : les plus anciens messages non résumés partent
+            # dans le résumé, en arrière-plan. La borne n'avance que sur ce qui
+            # est réellement résumé ; le reste attend le débordement suivant.
+            retained = self._fit(recent, int(budget * self.retain_ratio))
+            upto = _key(recent[len(retained)])
+            task = asyncio.create_task(self._refresh_summary(user_id, summary, upto))
+            self._refreshing[user_id] = task
+            task.add_done_callback(lambda t: self._refresh_done(user_id, t))
+
+        messages = [system]
+        if summary is not None and summary.text:
+            messages.append({"role": "system", "content": f"Résumé de la conversation précédente :\n{summary.text}"})
+        messages.extend({"role": m["role"], "content": m["content"]} for m in reversed(window))
+        messages.append(new)
+        return messages
+
+    async def _refresh_summary(self, user_id: str, previous: Optional[_Summary], upto: Cursor) -> None:
+        turns = await self._oldest_unsummarized(user_id, previous.boundary if previous else None, upto)
+        if not turns:
+            return
+        try:
+            text = await self.summarize(previous.text if previous else "", turns)
+        except SummaryPostponed:
+            # Réessayé au prochain débordement (la borne n'a pas bougé)
+            return
+        except RuntimeError as e:
+            # Résumé indisponible : les requêtes gardent la fenêtre récente, on réessaiera
+            logger.warning("Context summary failed for %s: %s", user_id, e)
+            return
+        self._store_summary(user_id, _Summary(boundary=_key(turns[-1]), text=self._truncate(text)))
+
+    def _refresh_done(self, user_id: str, task: asyncio.Task) -> None:
+        if self._refreshing.get(user_id) is task:
+            del self._refreshing[user_id]
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Context summary task failed", exc_info=task.exception())
+
+    @staticmethod
+    def _fit(items: List[Dict[str, str]], budget: int) -> List[Dict[str, str]]:
+        """Plus long préfixe de items (du plus récent au plus ancien) qui tient dans budget."""
+        total = 0
+        for i, item in enumerate(items):
+            total += message_tokens(item)
+            if total > budget:
+                return items[:i]
+        return items
+
+    def _truncate(self, text: str) -> str:
+        limit = self.summary_max_tokens * 4
+        return text if len(text) <= limit else text[:limit]
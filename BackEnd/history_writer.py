@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import os
+from typing import Dict, List, Optional, Set
+
+from storage import HistoryStore
+
+logger = logging.getLogger(__name__)
+
+# ==========
+# CONFIG
+# ==========
+# Garantie de durabilité des écritures d'historique :
+# - "request" : chaque message est écrit avant de répondre (un commit par message)
+# - "group"   : la requête attend le commit, mais les messages des requêtes
+#               simultanées partagent le même commit (group commit)
+# - "async"   : la requête n'attend pas ; écriture différée par lots
+#               (perte possible des derniers messages si le processus est tué)
+HISTORY_WRITE_MODE = os.getenv("HISTORY_WRITE_MODE", "async").strip().lower()
+# Délai max avant l'écriture d'un lot (millisecondes)
+HISTORY_FLUSH_INTERVAL_MS = int(os.getenv("HISTORY_FLUSH_INTERVAL_MS", "50"))
+HISTORY_MAX_BATCH = int(os.getenv("HISTORY_MAX_BATCH", "500"))
+# Taille max de la file : au-delà, les requêtes attendent (pression arrière)
+HISTORY_QUEUE_SIZE = int(os.getenv("HISTORY_QUEUE_SIZE", "10000"))
+
+WRITE_MODES = ("request", "group", "async")
+
+
+class HistoryWriter:
+    """
+    File d'écriture de l'historique, vidée par lots par une tâche de fond.
+
+    Pourquoi ?
+    - Chaque insertion TinyDB réécrit tout le fichier ; faite dans une route
+      async, elle bloque la boucle pour toutes les autres requêtes.
+    - Un lot = une seule écriture (un seul commit SQLite), exécutée dans un thread.
+
+    start()/stop() sont appelés par le lifespan de FastAPI ; stop() écrit
+    tout ce qui reste dans la file.
+    """
+
+    def __init__(
+        self,
+        store: HistoryStore,
+        mode: str = HISTORY_WRITE_MODE,
+        flush_interval: float = HISTORY_FLUSH_INTERVAL_MS / 1000,
+        max_batch: int = HISTORY_MAX_BATCH,
+        max_queue: int = HISTORY_QUEUE_SIZE,
+    ):
+        if mode not in WRITE_MODES:
+            raise RuntimeError(f"Unknown HISTORY_WRITE_MODE: {mode}")
+        self.store = store
+        self.mode = mode
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_queue = max_queue
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flush_requested: Optional[asyncio.Event] = None
+        self._done: Optional[asyncio.Condition] = None
+        # Numérotation des messages mis en file / traités, pour flush()
+        self._enqueued = 0
+        self._processed = 0
+        # Messages en attente par utilisateur (lecture de ses propres écritures)
+        self._pending: Dict[str, int] = {}
+        # Écritures directes lancées par write_nowait dans un thread, hors file
+        self._direct: Set[asyncio.Future] = set()
+
+    @property
+    def queued(self) -> int:
+        """Messages en attente d'écriture."""
+        return self._enqueued - self._processed + len(self._direct)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    # ---------- cycle de vie ----------
+    async def start(self) -> None:
+        if self.mode == "request" or self._task is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._flush_requested = asyncio.Event()
+        self._done = asyncio.Condition()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        await self.flush()
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    # ---------- écriture ----------
+    async def write(self, item: Dict[str, str]) -> None:
+        """Ajoute un message selon le mode de durabilité configuré."""
+        if not self.running:
+            await asyncio.to_thread(self.store.add, item)
+            return
+        await self._queue.put(item)
+        target = self._mark_enqueued(item)
+        if self.mode == "group":
+            await self._wait_processed(target)
+
+    def write_nowait(self, item: Dict[str, str]) -> None:
+        """
+        Variante sans attente, utilisable pendant l'annulation d'une tâche
+        (ex : client SSE déconnecté). File pleine ou mode "request" : écriture
+        directe, lancée dans un thread (jamais sur la boucle) et suivie par flush().
+        """
+        if self.running:
+            try:
+                self._queue.put_nowait(item)
+            except asyncio.QueueFull:
+                pass
+            else:
+                self._mark_enqueued(item)
+                return
+        user_id = item["user_id"]
+        self._pending[user_id] = self._pending.get(user_id, 0) + 1
+        future = asyncio.get_running_loop().run_in_executor(None, self.store.add, item)
+        self._direct.add(future)
+        future.add_done_callback(lambda f: self._direct_done(user_id, f))
+
+    def _direct_done(self, user_id: str, future: asyncio.Future) -> None:
+        self._direct.discard(future)
+        self._release_pending(user_id)
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("History write failed (1 message lost)", exc_info=future.exception())
+
+    def _release_pending(self, user_id: str) -> None:
+        remaining = self._pending.get(user_id, 0) - 1
+        if remaining > 0:
+            self._pending[user_id] = remaining
+        else:
+            self._pending.pop(user_id, None)
+
+    def _mark_enqueued(self, item: Dict[str, str]) -> int:
+        self._enqueued += 1
+        user_id = item["user_id"]
+        self._pending[user_id] = self._pending.get(user_id, 0) + 1
+        return self._enqueued
+
+    # ---------- synchronisation ----------
+    async def flush(self) -> None:
+        """Attend que tout ce qui est déjà en file soit écrit (sans attendre l'intervalle)."""
+        if self._direct:
+            await asyncio.gather(*list(self._direct), return_exceptions=True)
+        if not self.running or self._enqueued == self._processed:
+            return
+        self._flush_requested.set()
+        await self._wait_processed(self._enqueued)
+
+    async def sync_user(self, user_id: str) -> None:
+        """
+        Avant de lire l'historique d'un utilisateur : écrit ses messages encore
+        en file. Ne coûte rien s'il n'en a pas (cas le plus courant).
+        """
+        if self._pending.get(user_id):
+            await self.flush()
+
+    async def _wait_processed(self, target: int) -> None:
+        async with self._done:
+            await self._done.wait_for(lambda: self._processed >= target)
+
+    # ---------- tâche de fond ----------
+    async def _run(self) -> None:
+        while True:
+            first = await self._queue.get()
+            # On laisse le lot se remplir pendant flush_interval (sauf flush demandé)
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+
+            batch = [first]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            await self._commit(batch)
+
+            # Un flush demandé pendant le commit concerne peut-être des messages restés en file
+            if self._queue.empty():
+                self._flush_requested.clear()
+
+    async def _commit(self, batch: List[Dict[str, str]]) -> None:
+        try:
+            await asyncio.to_thread(self.store.add_many, batch)
+        except Exception:
+            # On ne bloque pas les écritures suivantes ; le lot perdu est journalisé
+            logger.exception("History batch write failed (%d messages lost)", len(batch))
+        for item in batch:
+            self._release_pending(item["user_id"])
+        async with self._done:
+            self._processed += len(batch)
+            self._done.notify_all()
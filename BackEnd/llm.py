@@ -1,12 +1,26 @@
+import asyncio
+import importlib.util
+import json
 import os
-from typing import Any, Dict, List
+import random
+import time
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
 
 import httpx
 
+from metrics import LLM_DURATION, record_llm_usage
+
 
 # Endpoint officiel OpenRouter (API "chat completions")
+# Surchargeable via OPENROUTER_URL (ex : serveur factice local pour les benchmarks)
 OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
 
+# Codes HTTP pour lesquels un nouvel essai a du sens (quota / panne passagère)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
 
 def _get_required_env(name: str) -> str:
     """
@@ -21,21 +35,199 @@ def _get_required_env(name: str) -> str:
     return value
 
 
-async def call_openrouter(messages: List[Dict[str, str]]) -> str:
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, str(default)))
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, str(default)))
+
+
+def _openrouter_url() -> str:
+    return os.getenv("OPENROUTER_URL", OPENROUTER_URL)
+
+
+def default_model() -> str:
+    return os.getenv("OPENROUTER_MODEL", "openrouter/auto")
+
+
+def default_temperature() -> float:
+    # temperature : contrôle la créativité (0 = très factuel, 1 = plus créatif)
+    return _env_float("OPENROUTER_TEMPERATURE", 0.7)
+
+
+# ==========
+# CLIENT HTTP PARTAGÉ
+# ==========
+# Un seul AsyncClient pour toute la durée de vie de l'application.
+# Pourquoi ?
+# - Les connexions TCP+TLS vers openrouter.ai sont réutilisées (keep-alive)
+#   au lieu de refaire une poignée de main à chaque message.
+# - Le pool limite le nombre de connexions simultanées vers le fournisseur.
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _build_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=_env_int("OPENROUTER_MAX_CONNECTIONS", 100),
+        max_keepalive_connections=_env_int("OPENROUTER_MAX_KEEPALIVE", 20),
+        keepalive_expiry=_env_float("OPENROUTER_KEEPALIVE_EXPIRY", 30.0),
+    )
+    # connect : établir la connexion ; read : attente entre deux octets reçus
+    # pool : attente d'une connexion libre quand le pool est plein
+    timeout = httpx.Timeout(
+        connect=_env_float("OPENROUTER_CONNECT_TIMEOUT", 5.0),
+        read=_env_float("OPENROUTER_READ_TIMEOUT", 30.0),
+        write=_env_float("OPENROUTER_WRITE_TIMEOUT", 10.0),
+        pool=_env_float("OPENROUTER_POOL_TIMEOUT", 10.0),
+    )
+    # HTTP/2 nécessite le paquet "h2" (httpx[http2]) ; sans lui on reste en HTTP/1.1
+    http2 = os.getenv("OPENROUTER_HTTP2", "1") == "1" and importlib.util.find_spec("h2") is not None
+    return httpx.AsyncClient(limits=limits, timeout=timeout, http2=http2)
+
+
+async def open_client() -> None:
+    """Crée le client partagé (appelé au démarrage de l'application)."""
+    global _client
+    if _client is None:
+        _client = _build_client()
+
+
+async def close_client() -> None:
+    """Ferme le client partagé et ses connexions (appelé à l'arrêt)."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_client() -> httpx.AsyncClient:
     """
-    Appelle OpenRouter et retourne la réponse texte de l'assistant.
+    Retourne le client partagé.
+    S'il n'a pas été ouvert (script, usage hors FastAPI), il est créé à la volée.
+    """
+    global _client
+    if _client is None:
+        _client = _build_client()
+    return _client
 
-    messages: liste du format :
-    [
-      {"role": "system", "content": "..."},
-      {"role": "user", "content": "..."}
-    ]
 
-    Pourquoi ce format ?
-    - C'est le format "Chat Completions" utilisé par OpenAI et par OpenRouter.
+# Appels OpenRouter en cours (exposé dans /metrics)
+_inflight = 0
+
+
+def inflight_requests() -> int:
+    return _inflight
+
+
+@contextmanager
+def _observe(model: str, mode: str) -> Iterator[Dict[str, str]]:
+    """
+    Mesure un appel OpenRouter (durée totale, y compris les nouveaux essais).
+    L'appelant passe outcome["status"] à "ok" en cas de succès.
+    """
+    global _inflight
+    _inflight += 1
+    outcome = {"status": "error"}
+    start = time.perf_counter()
+    try:
+        yield outcome
+    except (GeneratorExit, asyncio.CancelledError):
+        outcome["status"] = "cancelled"
+        raise
+    finally:
+        _inflight -= 1
+        LLM_DURATION.observe(time.perf_counter() - start, model, mode, outcome["status"])
+
+
+# ==========
+# RETRY / BACKOFF
+# ==========
+def _retry_after_seconds(resp: httpx.Response) -> Optional[float]:
+    """
+    Lit l'en-tête Retry-After (nombre de secondes ou date HTTP).
+    Retourne None s'il est absent ou illisible.
+    """
+    value = resp.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def _retry_delay(attempt: int, resp: Optional[httpx.Response] = None) -> Optional[float]:
+    """
+    Délai avant le nouvel essai n° attempt (0, 1, 2...), ou None s'il ne faut pas réessayer.
+    - Si le fournisseur indique Retry-After, on le respecte : s'il dépasse
+      OPENROUTER_RETRY_MAX_DELAY, on abandonne (réessayer plus tôt gaspillerait
+      du quota) et l'erreur remonte à l'appelant.
+    - Sinon backoff exponentiel avec "full jitter" : les clients qui ont échoué
+      en même temps ne réessaient pas tous au même instant.
+    """
+    max_delay = _env_float("OPENROUTER_RETRY_MAX_DELAY", 10.0)
+    if resp is not None:
+        retry_after = _retry_after_seconds(resp)
+        if retry_after is not None:
+            return retry_after if retry_after <= max_delay else None
+    base = _env_float("OPENROUTER_RETRY_BASE_DELAY", 0.5)
+    return random.uniform(0, min(max_delay, base * (2 ** attempt)))
+
+
+@asynccontextmanager
+async def _send(headers: Dict[str, str], payload: Dict[str, Any]) -> AsyncIterator[httpx.Response]:
+    """
+    Envoie la requête avec nouvel essai sur 429/5xx et erreurs réseau.
+    La réponse est ouverte en mode flux : les nouveaux essais n'ont lieu
+    qu'avant d'avoir transmis le moindre octet à l'appelant.
+    """
+    client = get_client()
+    max_retries = _env_int("OPENROUTER_MAX_RETRIES", 2)
+    attempt = 0
+    while True:
+        request = client.build_request("POST", _openrouter_url(), headers=headers, json=payload)
+        try:
+            resp = await client.send(request, stream=True)
+        except httpx.TransportError as e:
+            if attempt >= max_retries:
+                raise RuntimeError(f"OpenRouter unreachable: {type(e).__name__}") from e
+            await asyncio.sleep(_retry_delay(attempt))
+            attempt += 1
+            continue
+
+        if resp.status_code in RETRY_STATUSES and attempt < max_retries:
+            delay = _retry_delay(attempt, resp)
+            if delay is not None:
+                await resp.aclose()
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+
+        try:
+            yield resp
+        finally:
+            await resp.aclose()
+        return
+
+
+def _build_request(
+    messages: List[Dict[str, str]],
+    stream: bool,
+    model: Optional[str] = None,
+    temperature: Optional[float] = None,
+) -> tuple:
+    """
+    Construit (headers, payload) pour un appel OpenRouter.
+    Partagé entre le mode classique et le mode streaming.
+    Sans model/temperature, on prend OPENROUTER_MODEL / OPENROUTER_TEMPERATURE.
     """
     api_key = _get_required_env("OPENROUTER_API_KEY")
-    model = os.getenv("OPENROUTER_MODEL", "openrouter/auto")
 
     # Headers :
     # - Authorization est obligatoire : Bearer <clé>
@@ -48,24 +240,126 @@ async def call_openrouter(messages: List[Dict[str, str]]) -> str:
     }
 
     # Corps de la requête.
-    # temperature : contrôle la créativité (0 = très factuel, 1 = plus créatif)
     payload: Dict[str, Any] = {
-        "model": model,
+        "model": model or default_model(),
         "messages": messages,
-        "temperature": 0.7,
-        "stream": False,
+        "temperature": default_temperature() if temperature is None else temperature,
+        "stream": stream,
     }
+    return headers, payload
 
-    # On met un timeout pour éviter que le backend se bloque si le fournisseur est lent.
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        resp = await client.post(OPENROUTER_URL, headers=headers, json=payload)
 
-    # Si OpenRouter renvoie une erreur, on remonte un message explicite.
-    if resp.status_code != 200:
-        # On évite d'afficher la clé ou trop de détails sensibles.
-        raise RuntimeError(f"OpenRouter error: {resp.status_code} - {resp.text}")
+async def call_openrouter(
+    messages: List[Dict[str, str]],
+    model: Optional[str] = None,
+    temperature: Optional[float] = None,
+) -> str:
+    """
+    Appelle OpenRouter et retourne la réponse texte de l'assistant.
 
-    data = resp.json()
+    messages: liste du format :
+    [
+      {"role": "system", "content": "..."},
+      {"role": "user", "content": "..."}
+    ]
+
+    Pourquoi ce format ?
+    - C'est le format "Chat Completions" utilisé par OpenAI et par OpenRouter.
+    """
+    headers, payload = _build_request(messages, stream=False, model=model, temperature=temperature)
+
+    with _observe(payload["model"], "sync") as outcome:
+        # Client partagé (timeouts + pool) et nouveaux essais sur 429/5xx
+        async with _send(headers, payload) as resp:
+            try:
+                body = await resp.aread()
+            except httpx.TransportError as e:
+                raise RuntimeError(f"OpenRouter unreachable: {type(e).__name__}") from e
+
+        # Si OpenRouter renvoie une erreur, on remonte un message explicite.
+        if resp.status_code != 200:
+            # On évite d'afficher la clé ou trop de détails sensibles.
+            raise RuntimeError(f"OpenRouter error: {resp.status_code} - {body.decode('utf-8', errors='replace')}")
+
+        data = json.loads(body)
+        record_llm_usage(payload["model"], data.get("usage"))
+        outcome["status"] = "ok"
 
     # Le texte de réponse est dans choices[0].message.content
     return data["choices"][0]["message"]["content"]
+
+
+def _parse_sse_line(line: str) -> Any:
+    """
+    Décode une ligne SSE envoyée par OpenRouter.
+
+    Retourne :
+    - None pour les lignes à ignorer (vides, commentaires ": OPENROUTER PROCESSING")
+    - "[DONE]" pour la fin du flux
+    - le chunk JSON décodé sinon
+    """
+    if not line or line.startswith(":") or not line.startswith("data:"):
+        return None
+    data = line[len("data:"):].strip()
+    if data == "[DONE]":
+        return data
+    try:
+        return json.loads(data)
+    except ValueError:
+        return None
+
+
+async def stream_openrouter(
+    messages: List[Dict[str, str]],
+    model: Optional[str] = None,
+    temperature: Optional[float] = None,
+) -> AsyncIterator[str]:
+    """
+    Version streaming de call_openrouter : produit les morceaux de texte
+    (deltas) au fur et à mesure qu'OpenRouter les génère.
+
+    Pourquoi ?
+    - L'utilisateur voit les premiers mots dès qu'ils arrivent au lieu
+      d'attendre la génération complète (time-to-first-token).
+
+    Lève RuntimeError si OpenRouter répond une erreur, avant ou pendant le flux.
+    Si l'appelant arrête l'itération (client déconnecté), la connexion
+    amont est fermée proprement par le "async with".
+    """
+    headers, payload = _build_request(messages, stream=True, model=model, temperature=temperature)
+
+    with _observe(payload["model"], "stream") as outcome:
+        # Le timeout "read" s'applique entre deux morceaux, pas à la réponse entière.
+        async with _send(headers, payload) as resp:
+            if resp.status_code != 200:
+                body = (await resp.aread()).decode("utf-8", errors="replace")
+                raise RuntimeError(f"OpenRouter error: {resp.status_code} - {body}")
+
+            try:
+                async for line in resp.aiter_lines():
+                    chunk = _parse_sse_line(line)
+                    if chunk is None:
+                        continue
+                    if chunk == "[DONE]":
+                        outcome["status"] = "ok"
+                        return
+
+                    # Une erreur survenue après le début du flux arrive dans un chunk "error"
+                    if "error" in chunk:
+                        err = chunk["error"]
+                        message = err.get("message", err) if isinstance(err, dict) else err
+                        raise RuntimeError(f"OpenRouter stream error: {message}")
+
+                    # Le dernier chunk porte le décompte de tokens
+                    if chunk.get("usage"):
+                        record_llm_usage(payload["model"], chunk["usage"])
+
+                    choices = chunk.get("choices") or []
+                    if not choices:
+                        continue
+                    delta = (choices[0].get("delta") or {}).get("content")
+                    if delta:
+                        yield delta
+            except httpx.TransportError as e:
+                raise RuntimeError(f"OpenRouter stream interrupted: {type(e).__name__}") from e
+        outcome["status"] = "ok"
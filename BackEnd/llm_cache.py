@@ -0,0 +1,260 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# ==========
+# CONFIG
+# ==========
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "0") == "1"
+# Au-delà de cette température, les réponses sont voulues variées : pas de cache.
+# Volontairement sous OPENROUTER_TEMPERATURE par défaut (0.7) : activer le cache
+# ne fige pas les réponses échantillonnées ; baisser la température pour en profiter.
+LLM_CACHE_MAX_TEMPERATURE = float(os.getenv("LLM_CACHE_MAX_TEMPERATURE", "0.3"))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "3600"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000"))
+# Niveau disque (optionnel) : fichier SQLite partagé entre redémarrages / workers
+LLM_CACHE_DISK_PATH = os.getenv("LLM_CACHE_DISK_PATH", "")
+LLM_CACHE_DISK_MAX_MB = float(os.getenv("LLM_CACHE_DISK_MAX_MB", "50"))
+
+# Valeurs de l'en-tête X-Cache
+HIT = "HIT"
+MISS = "MISS"
+BYPASS = "BYPASS"
+
+_SPACES = re.compile(r"\s+")
+_TRAILING_PUNCT = re.compile(r"[\s?!.…]+$")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalise un message pour que des questions équivalentes aient la même clé :
+    Unicode NFKC, minuscules, espaces fusionnés, ponctuation finale retirée.
+    "Bonjour,  comment ça va ?" et "bonjour, comment ça va" -> même clé.
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = _SPACES.sub(" ", text).strip()
+    return _TRAILING_PUNCT.sub("", text)
+
+
+def cache_key(model: str, temperature: float, messages: List[Dict[str, str]]) -> str:
+    normalized = [[m["role"], normalize_text(m["content"])] for m in messages]
+    raw = json.dumps([model, round(temperature, 3), normalized], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# ==========
+# NIVEAU MÉMOIRE (LRU + TTL)
+# ==========
+class MemoryTier:
+    def __init__(self, max_entries: int, ttl: int):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if time.time() >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: str, expires_at: Optional[float] = None) -> None:
+        with self._lock:
+            self._entries[key] = (expires_at or time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+# ==========
+# NIVEAU DISQUE (SQLite, TTL + taille max)
+# ==========
+class DiskTier:
+    """
+    Réponses en cache dans un fichier SQLite.
+    Quand la taille totale dépasse max_bytes, on supprime d'un coup les entrées
+    les moins récemment utilisées, jusqu'à EVICT_TARGET_RATIO * max_bytes.
+
+    Méthodes bloquantes (I/O SQLite) : CompletionCache les appelle dans un thread.
+    """
+
+    # Après un dépassement on descend sous ce ratio : une éviction par lot,
+    # pas une à chaque écriture
+    EVICT_TARGET_RATIO = 0.9
+    # last_access n'est réécrit que s'il date de plus de N secondes :
+    # la plupart des HIT restent de simples lectures
+    ACCESS_RESOLUTION = 60
+
+    def __init__(self, path: Path, max_bytes: int, ttl: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        # Taille totale des réponses, tenue à jour à chaque écriture
+        # (recalculée au moment d'évincer : d'autres workers partagent le fichier)
+        self._total = 0
+        with self._lock:
+            self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Appelé avec le verrou déjà pris ; rouvre le fichier après close()
+        if self._conn is None:
+            conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+                " expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_completions_access ON completions (last_access)")
+            self._total = self._sum_sizes(conn)
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _sum_sizes(conn: sqlite3.Connection) -> int:
+        return conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        """Retourne (réponse, date d'expiration) ou None."""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value, size, expires_at, last_access FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, size, expires_at, last_access = row
+            if now >= expires_at:
+                if conn.execute("DELETE FROM completions WHERE key = ?", (key,)).rowcount:
+                    self._total -= size
+                return None
+            if now - last_access >= self.ACCESS_RESOLUTION:
+                conn.execute("UPDATE completions SET last_access = ? WHERE key = ?", (now, key))
+            return value, expires_at
+
+    def put(self, key: str, value: str) -> None:
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            conn = self._connect()
+            previous = conn.execute("SELECT size FROM completions WHERE key = ?", (key,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO completions (key, value, size, expires_at, last_access)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now + self.ttl, now),
+            )
+            self._total += size - (previous[0] if previous else 0)
+            if self._total > self.max_bytes:
+                self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        with conn:
+            conn.execute("BEGIN")
+            conn.execute("DELETE FROM completions WHERE expires_at <= ?", (now,))
+            self._total = self._sum_sizes(conn)
+            excess = self._total - int(self.max_bytes * self.EVICT_TARGET_RATIO)
+            if excess <= 0:
+                return
+            # Parcours de l'index last_access, arrêté dès que le lot suffit
+            victims, freed = [], 0
+            cursor = conn.execute("SELECT key, size FROM completions ORDER BY last_access")
+            for key, size in cursor:
+                victims.append((key,))
+                freed += size
+                if freed >= excess:
+                    break
+            cursor.close()
+            conn.executemany("DELETE FROM completions WHERE key = ?", victims)
+            self._total -= freed
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# ==========
+# CACHE DES RÉPONSES
+# ==========
+class CompletionCache:
+    """
+    Cache des réponses du modèle, clé = (modèle, température, messages normalisés).
+
+    Pourquoi ?
+    - Beaucoup de questions reviennent à l'identique (FAQ) : une réponse
+      en cache revient en quelques millisecondes au lieu de plusieurs secondes,
+      sans consommer de quota OpenRouter.
+    - Au-delà de max_temperature le cache est contourné : la variété des
+      réponses est alors voulue.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = LLM_CACHE_ENABLED,
+        max_temperature: float = LLM_CACHE_MAX_TEMPERATURE,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+        ttl: int = LLM_CACHE_TTL,
+        disk_path: str = LLM_CACHE_DISK_PATH,
+        disk_max_mb: float = LLM_CACHE_DISK_MAX_MB,
+    ):
+        self.enabled = enabled
+        self.max_temperature = max_temperature
+        self.memory = MemoryTier(max_entries, ttl)
+        self.disk: Optional[DiskTier] = None
+        if enabled and disk_path:
+            self.disk = DiskTier(Path(disk_path), int(disk_max_mb * 1024 * 1024), ttl)
+
+    def key_for(self, model: str, temperature: float, messages: List[Dict[str, str]]) -> Optional[str]:
+        """Clé de cache, ou None si le cache ne s'applique pas (désactivé, température haute)."""
+        if not self.enabled or temperature > self.max_temperature:
+            return None
+        return cache_key(model, temperature, messages)
+
+    async def get(self, key: str) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is not None or self.disk is None:
+            return value
+        # Niveau disque : I/O SQLite dans un thread, pas sur la boucle asyncio
+        found = await asyncio.to_thread(self.disk.get, key)
+        if found is None:
+            return None
+        # Promotion vers le niveau mémoire, sans prolonger la durée de vie
+        value, expires_at = found
+        self.memory.put(key, value, expires_at)
+        return value
+
+    async def put(self, key: str, value: str) -> None:
+        self.memory.put(key, value)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.put, key, value)
+
+    def close(self) -> None:
+        if self.disk is not None:
+            self.disk.close()
@@ -1,24 +1,74 @@
+import json
+import math
 import os
 import uuid
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
 from pathlib import Path
+from typing import Optional
 
 from dotenv import load_dotenv
-from fastapi import Depends, FastAPI, HTTPException
+from fastapi import BackgroundTasks, Depends, FastAPI, HTTPException, Query as QueryParam, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from tinydb import Query, TinyDB
-from llm import call_openrouter
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 
-# Charge BackEnd/.env (IMPORTANT: avant d'utiliser os.getenv dans security.py)
+# Charge BackEnd/.env (IMPORTANT: avant d'importer les modules qui lisent leur
+# configuration avec os.getenv : security.py, context.py, llm_cache.py...)
 load_dotenv()
 
-from security import create_access_token, get_user_id_from_token, hash_password, verify_password
+from context import ContextBuilder, SummaryPostponed, summarize_turns
+from history_writer import HistoryWriter
+from llm import (
+    call_openrouter,
+    close_client,
+    default_model,
+    default_temperature,
+    inflight_requests,
+    open_client,
+    stream_openrouter,
+)
+from llm_cache import BYPASS, HIT, MISS, CompletionCache
+from metrics import REGISTRY, MetricsMiddleware, gauge
+from ratelimit import ChatLimiter, Lease, RateLimitExceeded, open_limiter_backend
+from security import (
+    TOKEN_CACHE_SIZE,
+    TOKEN_CACHE_TTL,
+    PasswordHasherBusy,
+    TokenCache,
+    create_access_token,
+    get_password_hasher,
+    get_token_claims,
+    hash_password_async,
+    needs_rehash,
+    shutdown_password_hasher,
+    verify_password_async,
+)
+from storage import EmailAlreadyRegistered, UserStore, decode_cursor, encode_cursor, open_history_store
+
 
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Client HTTP OpenRouter partagé : ouvert au démarrage, fermé à l'arrêt
+    await open_client()
+    await history_writer.start()
+    yield
+    # Résumés de contexte en cours : abandonnés (recalculés au prochain débordement)
+    await context_builder.stop()
+    # Écrit les messages encore en file avant de fermer le stockage
+    await history_writer.stop()
+    await close_client()
+    completion_cache.close()
+    history_store.close()
+    user_store.close()
+    shutdown_password_hasher()
 
-app = FastAPI(title="AssistantIA API")
+
+app = FastAPI(title="AssistantIA API", lifespan=lifespan)
 
 # CORS (React)
 app.add_middleware(
@@ -32,35 +82,79 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Durée de chaque requête par route / méthode / statut (exposée sur /metrics)
+app.add_middleware(MetricsMiddleware)
+
 # --- BDD (TinyDB) ---
 BASE_DIR = Path(__file__).resolve().parent  # dossier BackEnd
-BDD_DIR = BASE_DIR / "BDD"
+# BDD_DIR permet de pointer vers un autre dossier (ex : données jetables des benchmarks)
+BDD_DIR = Path(os.getenv("BDD_DIR") or BASE_DIR / "BDD")
 BDD_DIR.mkdir(exist_ok=True)
 
-# ⬇️ FICHIERS BDD (NOUVEAUX NOMS)
-db_users = TinyDB(BDD_DIR / "users.json")
-db_history = TinyDB(BDD_DIR / "historique.json")
+# Utilisateurs : BDD/users.json (table "dbuser"), indexés par id et email
+user_store = UserStore(BDD_DIR / "users.json")
 
-# ⬇️ TABLES (noms logiques inchangés)
-dbuser = db_users.table("dbuser")
-dbhistorique = db_history.table("dbhistorique")
+# Tokens déjà vérifiés -> utilisateur (vidé pour un utilisateur modifié/supprimé)
+token_cache = TokenCache(max_size=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL)
+user_store.subscribe(token_cache.invalidate_user)
 
-UserQ = Query()
-HistQ = Query()
+# Historique : TinyDB ou SQLite selon HISTORY_BACKEND (voir storage.py)
+history_store = open_history_store(BDD_DIR)
+
+# Écritures d'historique par lots, hors du chemin de la requête (HISTORY_WRITE_MODE)
+history_writer = HistoryWriter(history_store)
+
+async def _summarize_within_limits(previous: str, turns: list) -> str:
+    """
+    Résumé de contexte (tâche de fond) soumis à UPSTREAM_MAX_CONCURRENCY,
+    comme les appels de /ai/chat : si tout est pris, il est reporté.
+    """
+    try:
+        lease = await chat_limiter.acquire_upstream()
+    except RateLimitExceeded:
+        raise SummaryPostponed()
+    try:
+        return await summarize_turns(previous, turns)
+    finally:
+        await lease.release()
+
+
+# Contexte envoyé au modèle : derniers échanges + résumé des plus anciens (voir context.py)
+context_builder = ContextBuilder(history_store, summarize=_summarize_within_limits)
+
+# Cache des réponses du modèle (LLM_CACHE_ENABLED=1, voir llm_cache.py)
+completion_cache = CompletionCache()
+
+# Limites de débit / concurrence sur /ai/chat (voir ratelimit.py)
+chat_limiter = ChatLimiter(open_limiter_backend())
+
+# --- Jauges de saturation (lues seulement quand /metrics est appelé) ---
+gauge("bcrypt_pool_pending", "Calculs bcrypt en cours ou en attente", lambda: get_password_hasher().pending)
+gauge("bcrypt_pool_max_pending", "Taille max de la file bcrypt", lambda: get_password_hasher().max_pending)
+gauge("llm_inflight_requests", "Appels OpenRouter en cours", inflight_requests)
+gauge("upstream_slots_max", "UPSTREAM_MAX_CONCURRENCY", lambda: chat_limiter.upstream_max)
+gauge("history_write_queue_depth", "Messages en attente d'écriture", lambda: history_writer.queued)
+gauge("token_cache_entries", "Tokens vérifiés en cache", lambda: len(token_cache))
+gauge("upstream_slots_in_use", "Places occupées sur UPSTREAM_MAX_CONCURRENCY", chat_limiter.upstream_in_use)
 
 # --- Auth (JWT Bearer) ---
 bearer = HTTPBearer(auto_error=True)
 
 def get_current_user(creds: HTTPAuthorizationCredentials = Depends(bearer)) -> dict:
     token = creds.credentials
+    user = token_cache.get(token)
+    if user is not None:
+        return user
+
     try:
-        user_id = get_user_id_from_token(token)
+        user_id, exp = get_token_claims(token)
     except ValueError:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
 
-    user = dbuser.get(UserQ.id == user_id)
+    user = user_store.get_by_id(user_id)
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
+    token_cache.put(token, user_id, user, exp)
     return user
 
 
@@ -69,33 +163,72 @@ def health_check():
     return {"status": "online"}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Métriques au format texte Prometheus."""
+    return PlainTextResponse(await REGISTRY.render_async(), media_type="text/plain; version=0.0.4")
+
+
 # ---------- AUTH ----------
+def _auth_busy() -> HTTPException:
+    # Pool bcrypt saturé : on demande au client de réessayer un peu plus tard
+    return HTTPException(status_code=503, detail="Authentication service busy", headers={"Retry-After": "1"})
+
+
+async def _rehash_password(user_id: str, password: str) -> None:
+    """
+    Recalcule le hash avec le coût actuel (BCRYPT_ROUNDS), après la réponse du login.
+    Opportuniste : si le pool bcrypt est saturé, on réessaiera au prochain login.
+    """
+    try:
+        new_hash = await hash_password_async(password)
+    except PasswordHasherBusy:
+        return
+    await run_in_threadpool(user_store.update, user_id, {"password_hash": new_hash})
+
+
 @app.post("/auth/register", status_code=201)
-def register(email: str, password: str):
+async def register(email: str, password: str):
     email_norm = email.strip().lower()
 
-    if dbuser.get(UserQ.email == email_norm):
+    if user_store.get_by_email(email_norm):
         raise HTTPException(status_code=409, detail="Email already registered")
 
+    try:
+        password_hash = await hash_password_async(password)
+    except PasswordHasherBusy:
+        raise _auth_busy()
+
     user_id = f"usr_{uuid.uuid4().hex}"
     user_doc = {
         "id": user_id,
         "email": email_norm,
-        "password_hash": hash_password(password),
+        "password_hash": password_hash,
         "created_at": datetime.now(timezone.utc).isoformat(),
     }
-    dbuser.insert(user_doc)
+    try:
+        await run_in_threadpool(user_store.insert, user_doc)
+    except EmailAlreadyRegistered:
+        raise HTTPException(status_code=409, detail="Email already registered")
     return {"id": user_id, "email": email_norm, "created_at": user_doc["created_at"]}
 
 
 @app.post("/auth/login")
-def login(email: str, password: str):
+async def login(email: str, password: str, background_tasks: BackgroundTasks):
     email_norm = email.strip().lower()
-    user = dbuser.get(UserQ.email == email_norm)
+    user = user_store.get_by_email(email_norm)
 
-    if not user or not verify_password(password, user["password_hash"]):
+    try:
+        valid = bool(user) and await verify_password_async(password, user["password_hash"])
+    except PasswordHasherBusy:
+        raise _auth_busy()
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
+    # Le coût bcrypt a changé depuis la création du hash : on le met à jour
+    if needs_rehash(user["password_hash"]):
+        background_tasks.add_task(_rehash_password, user["id"], password)
+
     token = create_access_token(user_id=user["id"])
     return {"access_token": token, "token_type": "bearer"}
 
@@ -107,7 +240,23 @@ def me(user=Depends(get_current_user)):
 
 # ---------- HISTORY ----------
 @app.get("/history")
-def history(limit: int = 50, offset: int = 0, user=Depends(get_current_user)):
+async def history(
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    order: str = QueryParam("asc", pattern="^(asc|desc)$"),
+    offset: int = QueryParam(0, deprecated=True),
+    user=Depends(get_current_user),
+):
+    """
+    Pagination par curseur :
+    - première page : sans "cursor"
+    - page suivante : cursor=<next_cursor de la page précédente>
+    - next_cursor vaut null quand il n'y a plus rien à lire
+    - order=desc pour partir des messages les plus récents
+
+    "offset" reste accepté pour les anciens clients (déprécié : coût
+    proportionnel à la profondeur, et décalé par les nouveaux messages).
+    """
     # garde-fous simples
     if limit < 1:
         limit = 1
@@ -117,60 +266,209 @@ def history(limit: int = 50, offset: int = 0, user=Depends(get_current_user)):
         offset = 0
 
     user_id = user["id"]
-    all_items = dbhistorique.search(HistQ.user_id == user_id)
+    newest_first = order == "desc"
+
+    # Messages de cet utilisateur encore en file d'écriture
+    await history_writer.sync_user(user_id)
+
+    # Ancien mode (offset), seulement si aucun curseur n'est fourni
+    if offset and cursor is None:
+        items = await run_in_threadpool(
+            history_store.list_for_user, user_id, limit=limit, offset=offset, newest_first=newest_first
+        )
+        return {"items": items, "limit": limit, "offset": offset, "order": order, "next_cursor": None}
+
+    after = None
+    if cursor is not None:
+        try:
+            after = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    # On lit un élément de plus pour savoir s'il existe une page suivante
+    items = await run_in_threadpool(
+        history_store.list_page, user_id, limit=limit + 1, after=after, newest_first=newest_first
+    )
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(items[-1])
+
+    return {"items": items, "limit": limit, "offset": 0, "order": order, "next_cursor": next_cursor}
 
-    # Tri par date (ISO) -> tri lexical OK
-    all_items.sort(key=lambda x: x.get("created_at", ""))
+# ---------- AI CHAT ----------
+SYSTEM_PROMPT = "Tu es un assistant utile et concis."
+
+
+def _new_message(user_id: str, role: str, content: str) -> dict:
+    return {
+        "id": f"msg_{uuid.uuid4().hex}",
+        "user_id": user_id,
+        "role": role,
+        "content": content,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def _rate_limited(e: RateLimitExceeded) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail=e.detail,
+        headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))},
+    )
+
+
+async def _acquire_chat_lease(user_id: str) -> Lease:
+    """Réserve la place de la requête ou répond 429 avec Retry-After."""
+    try:
+        return await chat_limiter.acquire(user_id)
+    except RateLimitExceeded as e:
+        raise _rate_limited(e)
+
+
+async def _acquire_upstream(lease: Lease) -> None:
+    """Place vers OpenRouter, seulement pour une réponse absente du cache (sinon 429)."""
+    try:
+        await lease.acquire_upstream()
+    except RateLimitExceeded as e:
+        raise _rate_limited(e)
+
+
+async def _chat(user_id: str, message: str, response: Response, lease: Lease) -> dict:
+    # 1) Construire le contexte (derniers échanges + résumé) avant d'ajouter le nouveau message
+    await history_writer.sync_user(user_id)
+    messages = await context_builder.build(user_id, SYSTEM_PROMPT, message)
+
+    # 2) Réponse en cache ? Sinon il faut une place vers OpenRouter (429 avant toute écriture)
+    model, temperature = default_model(), default_temperature()
+    cache_key = completion_cache.key_for(model, temperature, messages)
+    answer = await completion_cache.get(cache_key) if cache_key else None
+    response.headers["X-Cache"] = BYPASS if cache_key is None else (HIT if answer is not None else MISS)
+    if answer is None:
+        await _acquire_upstream(lease)
+
+    # 3) Sauvegarder le message utilisateur dans l'historique (écriture différée)
+    await history_writer.write(_new_message(user_id, "user", message))
+
+    # 4) Appel à l'IA (OpenRouter) si la réponse n'était pas en cache
+    if answer is None:
+        try:
+            answer = await call_openrouter(messages, model=model, temperature=temperature)
+        except RuntimeError as e:
+            # En cas d'erreur fournisseur, on renvoie une erreur propre côté API
+            raise HTTPException(status_code=502, detail=str(e))
+        if cache_key:
+            await completion_cache.put(cache_key, answer)
+
+    # 5) Sauvegarder la réponse de l'assistant
+    await history_writer.write(_new_message(user_id, "assistant", answer))
+
+    # 6) Retourner la réponse au client (frontend)
+    return {"answer": answer}
 
-    items = all_items[offset: offset + limit]
-    return {"items": items, "limit": limit, "offset": offset}
 
-# ---------- AI CHAT ----------
 @app.post("/ai/chat")
-async def ai_chat(message: str, user=Depends(get_current_user)):
+async def ai_chat(message: str, response: Response, user=Depends(get_current_user)):
     """
     Endpoint protégé :
     - nécessite un JWT valide (via get_current_user)
     - prend un message utilisateur
-    - appelle OpenRouter
+    - appelle OpenRouter avec le contexte de la conversation
     - stocke question + réponse dans l'historique
+
+    En-tête X-Cache : HIT (réponse en cache), MISS ou BYPASS (cache non applicable).
+    429 + Retry-After si l'utilisateur dépasse ses limites (voir ratelimit.py).
     """
     user_id = user["id"]
+    lease = await _acquire_chat_lease(user_id)
+    try:
+        return await _chat(user_id, message, response, lease)
+    finally:
+        await lease.release()
 
-    # 1) Sauvegarder le message utilisateur dans l'historique
-    dbhistorique.insert({
-        "id": f"msg_{uuid.uuid4().hex}",
-        "user_id": user_id,
-        "role": "user",
-        "content": message,
-        "created_at": datetime.now(timezone.utc).isoformat(),
-    })
 
-    # 2) Appeler l'IA (OpenRouter)
-    try:
-        answer = await call_openrouter([
-            {"role": "system", "content": "Tu es un assistant utile et concis."},
-            {"role": "user", "content": message},
-        ])
-    except RuntimeError as e:
-        # En cas d'erreur fournisseur, on renvoie une erreur propre côté API
-        raise HTTPException(status_code=502, detail=str(e))
-
-    # 3) Sauvegarder la réponse de l'assistant
-    dbhistorique.insert({
-        "id": f"msg_{uuid.uuid4().hex}",
-        "user_id": user_id,
-        "role": "assistant",
-        "content": answer,
-        "created_at": datetime.now(timezone.utc).isoformat(),
-    })
+def _sse(event: str, data: dict) -> str:
+    """Formate un évènement Server-Sent Events."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
-    # 4) Retourner la réponse au client (frontend)
-    return {"answer": answer}
+
+@app.post("/ai/chat/stream")
+async def ai_chat_stream(message: str, user=Depends(get_current_user)):
+    """
+    Variante streaming de /ai/chat (Server-Sent Events) :
+    - "delta" : un morceau de la réponse, dès qu'OpenRouter le produit
+    - "done"  : fin de la réponse (contient l'id du message sauvegardé)
+    - "error" : erreur fournisseur survenue pendant le flux
+
+    La réponse complète est sauvegardée dans l'historique à la fin du flux.
+    Si le client se déconnecte en cours de route, le flux amont est fermé
+    et la partie déjà générée est sauvegardée.
+    """
+    user_id = user["id"]
+    # Les places sont libérées à la fin du flux (voir event_stream et background)
+    lease = await _acquire_chat_lease(user_id)
+    try:
+        await history_writer.sync_user(user_id)
+        messages = await context_builder.build(user_id, SYSTEM_PROMPT, message)
+
+        model, temperature = default_model(), default_temperature()
+        cache_key = completion_cache.key_for(model, temperature, messages)
+        cached = await completion_cache.get(cache_key) if cache_key else None
+        cache_status = BYPASS if cache_key is None else (HIT if cached is not None else MISS)
+        if cached is None:
+            await _acquire_upstream(lease)
+
+        await history_writer.write(_new_message(user_id, "user", message))
+    except BaseException:
+        await lease.release()
+        raise
+
+    async def deltas():
+        # Réponse en cache : envoyée d'un bloc
+        if cached is not None:
+            yield cached
+            return
+        async for delta in stream_openrouter(messages, model=model, temperature=temperature):
+            yield delta
+
+    async def event_stream():
+        parts = []
+        try:
+            async for delta in deltas():
+                parts.append(delta)
+                yield _sse("delta", {"content": delta})
+        except RuntimeError as e:
+            yield _sse("error", {"detail": str(e)})
+            return
+        else:
+            # Flux complet (ni erreur ni déconnexion) : réutilisable depuis le cache
+            if cache_key and cached is None and parts:
+                await completion_cache.put(cache_key, "".join(parts))
+        finally:
+            # Exécuté aussi quand le client coupe la connexion (annulation du générateur)
+            answer = "".join(parts)
+            saved = None
+            if answer:
+                saved = _new_message(user_id, "assistant", answer)
+                # Sans attente : on peut être en pleine annulation (client déconnecté)
+                history_writer.write_nowait(saved)
+            await lease.release()
+        yield _sse("done", {"id": saved["id"] if saved else None})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Cache": cache_status},
+        # Filet de sécurité si le flux n'a jamais démarré (release est idempotent)
+        background=BackgroundTask(lease.release),
+    )
 
 # ---------- delete ----------
 @app.delete("/history")
-def clear_history(user=Depends(get_current_user)):
+async def clear_history(user=Depends(get_current_user)):
     user_id = user["id"]
-    removed = dbhistorique.remove(HistQ.user_id == user_id)
-    return {"deleted": len(removed)}
+    # Sinon des messages encore en file réapparaîtraient après la suppression
+    await history_writer.sync_user(user_id)
+    removed = await run_in_threadpool(history_store.clear_user, user_id)
+    context_builder.forget(user_id)
+    return {"deleted": removed}
@@ -0,0 +1,258 @@
+"""
+Métriques au format texte Prometheus, sans dépendance externe.
+
+- Histogram / Counter : valeurs par combinaison de labels
+- Gauge : valeur lue au moment de l'export (fonction de rappel, éventuellement async)
+- span() / timed() : mesure la durée d'un bloc ou d'une fonction
+- MetricsMiddleware : durée de chaque requête HTTP par route, méthode, statut
+
+Coût sur le chemin critique : un perf_counter(), une recherche dichotomique
+dans les seuils et une mise à jour de dict sous verrou.
+"""
+import inspect
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from typing import Awaitable, Callable, Dict, Iterator, List, Sequence, Tuple, Union
+
+# Seuils (secondes) : de la milliseconde (cache, index) à la minute (LLM)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def render(self) -> List[str]:
+        return self._header() + self._samples()
+
+    async def render_async(self) -> List[str]:
+        return self.render()
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        ...
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labelvalues: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [compteurs par seuil (+Inf en dernier), somme]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labelvalues)
+            if entry is None:
+                entry = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(counts), total) for k, (counts, total) in self._values.items()]
+        lines = []
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Valeur instantanée, lue à l'export : rien à mettre à jour sur le chemin critique."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, read: Callable[[], Union[float, Awaitable[float]]]):
+        super().__init__(name, help_text)
+        self.read = read
+
+    def _samples(self) -> List[str]:
+        try:
+            value = self.read()
+        except Exception:
+            return []
+        if inspect.isawaitable(value):
+            # Lecture async (ex : backend du limiteur distant) : seul render_async() peut l'attendre
+            if inspect.iscoroutine(value):
+                value.close()
+            return []
+        return [f"{self.name} {_format_value(value)}"]
+
+    async def render_async(self) -> List[str]:
+        try:
+            value = self.read()
+            if inspect.isawaitable(value):
+                value = await value
+        except Exception:
+            return self._header()
+        return self._header() + [f"{self.name} {_format_value(value)}"]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        # Ré-enregistrer sous le même nom remplace la métrique (ex : jauge rebranchée)
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    async def render_async(self) -> str:
+        """Comme render(), en attendant les jauges dont la lecture est async."""
+        lines: List[str] = []
+        for metric in list(self._metrics.values()):
+            lines.extend(await metric.render_async())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_DURATION = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "Durée des requêtes HTTP (jusqu'au dernier octet)",
+    ("method", "route", "status"),
+))
+SPAN_DURATION = REGISTRY.register(Histogram(
+    "span_duration_seconds", "Durée des opérations internes (stockage, bcrypt, JWT...)", ("span",),
+))
+LLM_DURATION = REGISTRY.register(Histogram(
+    "llm_request_duration_seconds", "Durée des appels OpenRouter", ("model", "mode", "status"),
+))
+LLM_TOKENS = REGISTRY.register(Counter(
+    "llm_tokens_total", "Tokens consommés selon le champ usage d'OpenRouter", ("model", "type"),
+))
+
+
+def gauge(name: str, help_text: str, read: Callable[[], Union[float, Awaitable[float]]]) -> None:
+    """Expose une valeur lue à la demande (taille de file, places occupées...) ; read peut être async."""
+    REGISTRY.register(Gauge(name, help_text, read))
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        SPAN_DURATION.observe(time.perf_counter() - start, name)
+
+
+def timed(name: str) -> Callable:
+    """Décorateur : enregistre la durée de chaque appel dans span_duration_seconds."""
+
+    def decorator(fn: Callable) -> Callable:
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                SPAN_DURATION.observe(time.perf_counter() - start, name)
+
+        return wrapper
+
+    return decorator
+
+
+def record_llm_usage(model: str, usage: dict) -> None:
+    """Ajoute les compteurs de tokens du champ "usage" d'une réponse OpenRouter."""
+    if not isinstance(usage, dict):
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        value = usage.get(kind)
+        if isinstance(value, (int, float)):
+            LLM_TOKENS.inc(model, kind.replace("_tokens", ""), amount=value)
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI : durée de chaque requête HTTP, jusqu'à la fin de la réponse
+    (flux SSE compris). La route est le modèle de chemin ("/history"), pas l'URL
+    réelle, pour garder un nombre de séries borné.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = "500"
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_DURATION.observe(time.perf_counter() - start, scope.get("method", ""), path, status)
@@ -0,0 +1,66 @@
+"""
+Importe l'historique TinyDB (BDD/historique.json) dans la base SQLite.
+
+Usage (depuis BackEnd) :
+    python migrate_history.py
+    python migrate_history.py --source BDD/historique.json --target BDD/historique.sqlite3
+
+Rejouable sans risque : les messages déjà importés (même id) sont ignorés.
+Ensuite, lancer l'API avec HISTORY_BACKEND=sqlite.
+"""
+import argparse
+import time
+from pathlib import Path
+
+from storage import SQLiteHistoryStore, TinyDBHistoryStore
+
+BDD_DIR = Path(__file__).resolve().parent / "BDD"
+
+
+def migrate(sources, target: Path, batch_size: int = 1000) -> int:
+    store = SQLiteHistoryStore(target)
+    before = store.count()
+    try:
+        for source in sources:
+            if not Path(source).exists():
+                print(f"{source}: introuvable, ignoré")
+                continue
+            legacy = TinyDBHistoryStore(source)
+            try:
+                items = legacy.all_items()
+            finally:
+                legacy.close()
+
+            # On ignore les entrées incomplètes plutôt que d'interrompre la migration
+            valid = [
+                item for item in items
+                if all(item.get(k) is not None for k in ("id", "user_id", "role", "content", "created_at"))
+            ]
+            skipped = len(items) - len(valid)
+
+            for i in range(0, len(valid), batch_size):
+                store.add_many(valid[i: i + batch_size])
+            print(f"{source}: {len(valid)} messages lus, {skipped} ignorés (incomplets)")
+
+        imported = store.count() - before
+    finally:
+        store.close()
+    return imported
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Migration de l'historique TinyDB vers SQLite")
+    parser.add_argument("--source", type=Path, nargs="+", default=[BDD_DIR / "historique.json"],
+                        help="fichier(s) TinyDB à importer")
+    parser.add_argument("--target", type=Path, default=BDD_DIR / "historique.sqlite3",
+                        help="base SQLite de destination")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    imported = migrate(args.source, args.target, args.batch_size)
+    print(f"{imported} nouveaux messages importés dans {args.target} en {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
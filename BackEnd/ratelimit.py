@@ -0,0 +1,223 @@
+import asyncio
+import os
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Tuple
+
+# ==========
+# CONFIG
+# ==========
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").strip().lower()
+# Seau à jetons par utilisateur : débit moyen et rafale autorisée
+CHAT_RATE_PER_MINUTE = float(os.getenv("CHAT_RATE_PER_MINUTE", "20"))
+CHAT_BURST = int(os.getenv("CHAT_BURST", "5"))
+# Requêtes /ai/chat simultanées par utilisateur
+CHAT_MAX_INFLIGHT = int(os.getenv("CHAT_MAX_INFLIGHT", "2"))
+# Appels simultanés vers OpenRouter, tous utilisateurs confondus
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", "32"))
+
+_UPSTREAM_KEY = "upstream"
+# Délai max annoncé dans Retry-After (secondes) ; un débit nul donnerait un délai infini
+MAX_RETRY_AFTER = 3600
+
+
+class RateLimitExceeded(Exception):
+    """Requête refusée ; retry_after = délai conseillé avant de réessayer (secondes)."""
+
+    def __init__(self, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = min(retry_after, MAX_RETRY_AFTER)
+
+
+# ==========
+# BACKENDS (où vit l'état du limiteur)
+# ==========
+class LimiterBackend(ABC):
+    """
+    État partagé du limiteur : seaux à jetons et compteurs de "places".
+
+    L'implémentation mémoire suffit pour un seul processus. Pour plusieurs
+    workers uvicorn, une implémentation sur un stockage partagé (Redis...)
+    fournit les mêmes opérations, de façon atomique.
+    """
+
+    @abstractmethod
+    async def take_token(self, key: str, rate: float, burst: int) -> float:
+        """
+        Prend un jeton dans le seau "key" (rate jetons/seconde, capacité burst).
+        Retourne 0 si accordé, sinon le délai (secondes) avant le prochain jeton.
+        """
+
+    @abstractmethod
+    async def acquire_slot(self, key: str, limit: int) -> bool:
+        """Réserve une place parmi limit ; False si toutes sont prises."""
+
+    @abstractmethod
+    async def release_slot(self, key: str) -> None:
+        """Libère une place réservée avec acquire_slot."""
+
+    @abstractmethod
+    async def slots_in_use(self, key: str) -> int:
+        """Places actuellement réservées (pour la supervision)."""
+
+
+class InMemoryLimiterBackend(LimiterBackend):
+    """
+    État en mémoire du processus.
+    Pas de verrou : les méthodes ne contiennent aucun await, elles s'exécutent
+    donc d'un bloc dans la boucle asyncio.
+    """
+
+    # Au-delà, on retire les seaux pleins (utilisateurs inactifs)
+    MAX_BUCKETS = 10000
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}  # key -> (jetons, instant)
+        self._slots: Dict[str, int] = {}
+
+    async def take_token(self, key: str, rate: float, burst: int) -> float:
+        now = time.monotonic()
+        tokens, last = self._buckets.get(key, (float(burst), now))
+        tokens = min(float(burst), tokens + (now - last) * rate)
+        if tokens >= 1:
+            self._buckets[key] = (tokens - 1, now)
+            if len(self._buckets) > self.MAX_BUCKETS:
+                self._prune(now, rate, burst)
+            return 0.0
+        self._buckets[key] = (tokens, now)
+        return (1 - tokens) / rate if rate > 0 else float("inf")
+
+    def _prune(self, now: float, rate: float, burst: int) -> None:
+        # Un seau redevenu plein équivaut à un seau absent
+        for key, (tokens, last) in list(self._buckets.items()):
+            if tokens + (now - last) * rate >= burst:
+                del self._buckets[key]
+
+    async def acquire_slot(self, key: str, limit: int) -> bool:
+        used = self._slots.get(key, 0)
+        if used >= limit:
+            return False
+        self._slots[key] = used + 1
+        return True
+
+    async def release_slot(self, key: str) -> None:
+        used = self._slots.get(key, 0) - 1
+        if used > 0:
+            self._slots[key] = used
+        else:
+            self._slots.pop(key, None)
+
+    async def slots_in_use(self, key: str) -> int:
+        return self._slots.get(key, 0)
+
+
+def open_limiter_backend() -> LimiterBackend:
+    """Backend choisi par RATE_LIMIT_BACKEND (seul "memory" est fourni)."""
+    if RATE_LIMIT_BACKEND == "memory":
+        return InMemoryLimiterBackend()
+    raise RuntimeError(f"Unknown RATE_LIMIT_BACKEND: {RATE_LIMIT_BACKEND}")
+
+
+# ==========
+# LIMITEUR /ai/chat
+# ==========
+class Lease:
+    """Places réservées pour une requête ; release() est idempotent."""
+
+    def __init__(self, backend: LimiterBackend, keys: Tuple[str, ...], upstream_max: Optional[int] = None):
+        self._backend = backend
+        # Places encore à libérer (une place n'en sort qu'une fois libérée)
+        self._keys = list(keys)
+        # None : limiteur désactivé, pas de place amont à réserver
+        self._upstream_max = upstream_max
+        self._released = False
+        self._releasing: Optional[asyncio.Future] = None
+
+    async def acquire_upstream(self) -> None:
+        """
+        Réserve une place vers OpenRouter (UPSTREAM_MAX_CONCURRENCY), seulement
+        quand la réponse n'est pas en cache. Lève RateLimitExceeded si tout est pris.
+        """
+        if self._upstream_max is None or self._released or _UPSTREAM_KEY in self._keys:
+            return
+        if not await self._backend.acquire_slot(_UPSTREAM_KEY, self._upstream_max):
+            raise RateLimitExceeded("Server busy, retry later", retry_after=1)
+        self._keys.append(_UPSTREAM_KEY)
+
+    async def release(self) -> None:
+        """
+        Libère les places, même si la tâche appelante est en cours d'annulation
+        (finally d'un flux SSE dont le client s'est déconnecté) : la libération
+        tourne dans sa propre tâche, protégée par asyncio.shield. Si le backend
+        échoue, l'appel suivant reprend les places restantes.
+        """
+        self._released = True
+        if not self._keys and (self._releasing is None or self._releasing.done()):
+            return
+        if self._releasing is None or self._releasing.done():
+            self._releasing = asyncio.ensure_future(self._release_keys())
+        await asyncio.shield(self._releasing)
+
+    async def _release_keys(self) -> None:
+        while self._keys:
+            await self._backend.release_slot(self._keys[0])
+            self._keys.pop(0)
+
+
+class ChatLimiter:
+    """
+    Trois protections :
+    1. requêtes simultanées par utilisateur (CHAT_MAX_INFLIGHT)
+    2. débit par utilisateur, seau à jetons (CHAT_RATE_PER_MINUTE, CHAT_BURST)
+    3. appels simultanés vers OpenRouter, tous utilisateurs (UPSTREAM_MAX_CONCURRENCY)
+
+    acquire() vérifie 1 puis 2 ; un jeton n'est consommé que si la requête
+    obtient sa place. La place 3 n'est réservée (Lease.acquire_upstream) que
+    si la réponse n'est pas en cache : un HIT ne part pas chez le fournisseur.
+    """
+
+    def __init__(
+        self,
+        backend: LimiterBackend,
+        enabled: bool = RATE_LIMIT_ENABLED,
+        rate_per_minute: float = CHAT_RATE_PER_MINUTE,
+        burst: int = CHAT_BURST,
+        max_inflight: int = CHAT_MAX_INFLIGHT,
+        upstream_max: int = UPSTREAM_MAX_CONCURRENCY,
+    ):
+        self.backend = backend
+        self.enabled = enabled
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.max_inflight = max_inflight
+        self.upstream_max = upstream_max
+
+    async def upstream_in_use(self) -> int:
+        return await self.backend.slots_in_use(_UPSTREAM_KEY)
+
+    async def acquire_upstream(self) -> Lease:
+        """
+        Place vers OpenRouter seule, pour les appels de fond (ex : résumé de
+        contexte) ; lève RateLimitExceeded si tout est pris.
+        """
+        lease = Lease(self.backend, (), upstream_max=self.upstream_max if self.enabled else None)
+        await lease.acquire_upstream()
+        return lease
+
+    async def acquire(self, user_id: str) -> Lease:
+        """Réserve la place de la requête ; lève RateLimitExceeded si refusée."""
+        if not self.enabled:
+            return Lease(self.backend, ())
+
+        inflight_key = f"inflight:{user_id}"
+        if not await self.backend.acquire_slot(inflight_key, self.max_inflight):
+            raise RateLimitExceeded("Too many concurrent requests", retry_after=1)
+
+        wait = await self.backend.take_token(f"bucket:{user_id}", self.rate, self.burst)
+        if wait > 0:
+            await self.backend.release_slot(inflight_key)
+            raise RateLimitExceeded("Rate limit exceeded", retry_after=wait)
+
+        return Lease(self.backend, (inflight_key,), upstream_max=self.upstream_max)
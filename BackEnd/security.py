@@ -1,10 +1,17 @@
+import asyncio
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Any, Dict
+from typing import Any, Callable, Dict, Optional, Set, Tuple
 
 import bcrypt
 from jose import JWTError, jwt
 
+from metrics import span, timed
+
 # ==========
 # CONFIG
 # ==========
@@ -12,15 +19,27 @@ JWT_SECRET = os.getenv("JWT_SECRET", "CHANGE_ME")
 JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 JWT_EXPIRES_MINUTES = int(os.getenv("JWT_EXPIRES_MINUTES", "15"))
 
+# Coût bcrypt (2^rounds itérations). 12 ≈ 250 ms de CPU par hash.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Nombre de hash calculés en parallèle, et file d'attente maximale au-delà
+BCRYPT_POOL_SIZE = int(os.getenv("BCRYPT_POOL_SIZE", str(os.cpu_count() or 2)))
+BCRYPT_MAX_PENDING = int(os.getenv("BCRYPT_MAX_PENDING", "64"))
+
+# Cache des tokens vérifiés : nombre d'entrées max et durée de vie max (secondes)
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL = int(os.getenv("TOKEN_CACHE_TTL", "300"))
+
 # ==========
 # PASSWORDS (bcrypt)
 # ==========
+@timed("security.hash_password")
 def hash_password(password: str) -> str:
-    salt = bcrypt.gensalt(rounds=12)
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
     hashed = bcrypt.hashpw(password.encode("utf-8"), salt)
     return hashed.decode("utf-8")
 
 
+@timed("security.verify_password")
 def verify_password(password: str, password_hash: str) -> bool:
     try:
         return bcrypt.checkpw(
@@ -31,9 +50,102 @@ def verify_password(password: str, password_hash: str) -> bool:
         return False
 
 
+def needs_rehash(password_hash: str) -> bool:
+    """
+    Vrai si le hash a été calculé avec un autre coût que BCRYPT_ROUNDS.
+    Format bcrypt : $2b$<coût>$<sel+hash>
+    """
+    try:
+        return int(password_hash.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
+
+
+class PasswordHasherBusy(Exception):
+    """Trop de calculs bcrypt en attente : la requête doit être refusée (503)."""
+
+
+class PasswordHasher:
+    """
+    Exécute bcrypt dans un pool de threads dédié, de taille limitée.
+
+    Pourquoi ?
+    - Un hash coûte ~250 ms de CPU : exécuté dans la route, il bloque
+      la boucle asyncio ou un thread du pool de FastAPI.
+    - bcrypt libère le GIL pendant le calcul : des threads suffisent
+      pour utiliser plusieurs cœurs.
+    - La file d'attente est bornée : au-delà de max_pending, on refuse
+      tout de suite (PasswordHasherBusy) au lieu d'accumuler de la latence.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bcrypt")
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        """Calculs en cours ou en attente."""
+        return self._pending
+
+    async def _run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise PasswordHasherBusy()
+            self._pending += 1
+        try:
+            # Attente dans la file + calcul (le calcul seul est mesuré par @timed)
+            with span("security.bcrypt_pool"):
+                return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password)
+
+    async def verify(self, password: str, password_hash: str) -> bool:
+        return await self._run(verify_password, password, password_hash)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_hasher: Optional[PasswordHasher] = None
+
+
+def get_password_hasher() -> PasswordHasher:
+    """Pool bcrypt partagé, créé au premier usage (et recréé après shutdown_password_hasher)."""
+    global _hasher
+    if _hasher is None:
+        _hasher = PasswordHasher(BCRYPT_POOL_SIZE, BCRYPT_MAX_PENDING)
+    return _hasher
+
+
+def shutdown_password_hasher() -> None:
+    """Arrête le pool bcrypt (appelé à l'arrêt) ; un redémarrage en crée un nouveau."""
+    global _hasher
+    if _hasher is not None:
+        _hasher.shutdown()
+        _hasher = None
+
+
+async def hash_password_async(password: str) -> str:
+    """hash_password exécuté dans le pool bcrypt (lève PasswordHasherBusy si saturé)."""
+    return await get_password_hasher().hash(password)
+
+
+async def verify_password_async(password: str, password_hash: str) -> bool:
+    """verify_password exécuté dans le pool bcrypt (lève PasswordHasherBusy si saturé)."""
+    return await get_password_hasher().verify(password, password_hash)
+
+
 # ==========
 # JWT
 # ==========
+@timed("security.create_access_token")
 def create_access_token(user_id: str) -> str:
     now = datetime.now(timezone.utc)
     exp = now + timedelta(minutes=JWT_EXPIRES_MINUTES)
@@ -47,6 +159,7 @@ def create_access_token(user_id: str) -> str:
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
 
+@timed("security.decode_access_token")
 def decode_access_token(token: str) -> Dict[str, Any]:
     try:
         return jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
@@ -54,9 +167,81 @@ def decode_access_token(token: str) -> Dict[str, Any]:
         raise ValueError("invalid_token") from e
 
 
-def get_user_id_from_token(token: str) -> str:
+def get_token_claims(token: str) -> Tuple[str, int]:
+    """Retourne (user_id, exp) d'un token valide ; lève ValueError sinon."""
     payload = decode_access_token(token)
     user_id = payload.get("sub")
-    if not user_id:
+    exp = payload.get("exp")
+    if not user_id or not isinstance(exp, int):
         raise ValueError("invalid_token_payload")
-    return user_id
+    return user_id, exp
+
+
+# ==========
+# CACHE DES TOKENS VÉRIFIÉS
+# ==========
+class TokenCache:
+    """
+    Cache LRU + TTL : token déjà vérifié -> fiche utilisateur.
+
+    Pourquoi ?
+    - Chaque requête protégée décode le JWT puis cherche l'utilisateur ;
+      pour un même token, le résultat ne change pas tant que le token est
+      valide et que l'utilisateur n'est pas modifié.
+
+    Garanties :
+    - taille bornée (les entrées les moins récemment utilisées sortent)
+    - une entrée n'est jamais servie après le "exp" du token
+    - invalidate_user() retire toutes les entrées d'un utilisateur
+    """
+
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, str, Dict[str, Any]]]" = OrderedDict()
+        self._by_user: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            expires_at, user_id, user = entry
+            if time.time() >= expires_at:
+                self._remove(token)
+                return None
+            self._entries.move_to_end(token)
+            return user
+
+    def put(self, token: str, user_id: str, user: Dict[str, Any], exp: int) -> None:
+        expires_at = min(time.time() + self.ttl, exp)
+        with self._lock:
+            if token in self._entries:
+                self._remove(token)
+            self._entries[token] = (expires_at, user_id, user)
+            self._by_user.setdefault(user_id, set()).add(token)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id: str) -> None:
+        with self._lock:
+            for token in list(self._by_user.get(user_id, ())):
+                self._remove(token)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    def _remove(self, token: str) -> None:
+        # Appelé avec le verrou déjà pris
+        _, user_id, _ = self._entries.pop(token)
+        tokens = self._by_user.get(user_id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._by_user[user_id]
@@ -0,0 +1,465 @@
+import base64
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from tinydb import Query, TinyDB
+from tinydb.table import Table
+
+from metrics import timed
+
+
+# Position dans l'historique : (created_at, id) du dernier message vu.
+# L'id départage les messages créés à la même microseconde.
+Cursor = Tuple[str, str]
+
+
+# ==========
+# CURSEURS (pagination par clé)
+# ==========
+def encode_cursor(item: Dict[str, str]) -> str:
+    """Curseur opaque pour le client : base64url de [created_at, id]."""
+    raw = json.dumps([item["created_at"], item["id"]], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Cursor:
+    """Lève ValueError si le curseur n'a pas été produit par encode_cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, item_id = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError("invalid_cursor") from e
+    if not isinstance(created_at, str) or not isinstance(item_id, str):
+        raise ValueError("invalid_cursor")
+    return created_at, item_id
+
+
+# ==========
+# INTERFACE
+# ==========
+class HistoryStore(ABC):
+    """
+    Stockage de l'historique des conversations.
+
+    Les routes de main.py ne parlent qu'à cette interface :
+    on peut changer de moteur (TinyDB, SQLite...) sans toucher aux routes.
+
+    Un message est un dict : id, user_id, role, content, created_at (ISO 8601 UTC).
+    """
+
+    @abstractmethod
+    def add(self, item: Dict[str, str]) -> None:
+        """Ajoute un message."""
+
+    @abstractmethod
+    def add_many(self, items: Iterable[Dict[str, str]]) -> None:
+        """Ajoute plusieurs messages en une seule écriture."""
+
+    @abstractmethod
+    def list_for_user(
+        self, user_id: str, limit: int, offset: int = 0, newest_first: bool = False
+    ) -> List[Dict[str, str]]:
+        """Messages d'un utilisateur, du plus ancien au plus récent (ou l'inverse)."""
+
+    @abstractmethod
+    def list_page(
+        self, user_id: str, limit: int, after: Optional[Cursor] = None, newest_first: bool = False
+    ) -> List[Dict[str, str]]:
+        """
+        Page de messages située juste après la position "after" (exclue),
+        dans l'ordre demandé. Contrairement à offset, le coût ne dépend pas
+        de la profondeur de la page et les insertions ne décalent rien.
+        """
+
+    @abstractmethod
+    def clear_user(self, user_id: str) -> int:
+        """Supprime l'historique d'un utilisateur ; retourne le nombre de messages supprimés."""
+
+    def close(self) -> None:
+        """Libère les ressources (fichiers, connexions)."""
+
+
+# ==========
+# TINYDB (historique.json)
+# ==========
+class TinyDBHistoryStore(HistoryStore):
+    """
+    Implémentation historique : tout l'historique dans un fichier JSON.
+    Simple, mais chaque écriture réécrit le fichier et chaque lecture parcourt
+    les messages de tous les utilisateurs.
+    """
+
+    def __init__(self, path: Path):
+        self._path = path
+        self._db: Optional[TinyDB] = None
+        # TinyDB n'est pas thread-safe ; les routes synchrones tournent dans un pool de threads
+        self._lock = threading.Lock()
+        with self._lock:
+            self._table()
+
+    def _table(self) -> Table:
+        # Appelé avec le verrou déjà pris. Rouvre le fichier après close()
+        # (ex : arrêt puis redémarrage de l'application dans le même processus).
+        if self._db is None:
+            self._db = TinyDB(self._path)
+        return self._db.table("dbhistorique")
+
+    @timed("history.tinydb.add")
+    def add(self, item: Dict[str, str]) -> None:
+        with self._lock:
+            self._table().insert(item)
+
+    @timed("history.tinydb.add_many")
+    def add_many(self, items: Iterable[Dict[str, str]]) -> None:
+        with self._lock:
+            self._table().insert_multiple(list(items))
+
+    def _sorted_for_user(self, user_id: str, newest_first: bool) -> List[Dict[str, str]]:
+        with self._lock:
+            items = self._table().search(Query().user_id == user_id)
+        # Tri par date (ISO) -> tri lexical OK
+        items.sort(key=lambda x: (x.get("created_at", ""), x.get("id", "")), reverse=newest_first)
+        return items
+
+    @timed("history.tinydb.list_for_user")
+    def list_for_user(
+        self, user_id: str, limit: int, offset: int = 0, newest_first: bool = False
+    ) -> List[Dict[str, str]]:
+        items = self._sorted_for_user(user_id, newest_first)
+        return [dict(x) for x in items[offset: offset + limit]]
+
+    @timed("history.tinydb.list_page")
+    def list_page(
+        self, user_id: str, limit: int, after: Optional[Cursor] = None, newest_first: bool = False
+    ) -> List[Dict[str, str]]:
+        # TinyDB n'a pas d'index : on parcourt quand même tout, mais le résultat
+        # est identique à celui de SQLite (mêmes curseurs).
+        items = self._sorted_for_user(user_id, newest_first)
+        if after is not None:
+            if newest_first:
+                items = [x for x in items if (x.get("created_at", ""), x.get("id", "")) < after]
+            else:
+                items = [x for x in items if (x.get("created_at", ""), x.get("id", "")) > after]
+        return [dict(x) for x in items[:limit]]
+
+    @timed("history.tinydb.clear_user")
+    def clear_user(self, user_id: str) -> int:
+        with self._lock:
+            return len(self._table().remove(Query().user_id == user_id))
+
+    def all_items(self) -> List[Dict[str, str]]:
+        """Tous les messages (utilisé par l'outil de migration)."""
+        with self._lock:
+            return [dict(x) for x in self._table().all()]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+# ==========
+# SQLITE (WAL)
+# ==========
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    seq        INTEGER PRIMARY KEY,
+    id         TEXT NOT NULL UNIQUE,
+    user_id    TEXT NOT NULL,
+    role       TEXT NOT NULL,
+    content    TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_user_created ON messages (user_id, created_at, id);
+"""
+
+_COLUMNS = ("id", "user_id", "role", "content", "created_at")
+
+
+class SQLiteHistoryStore(HistoryStore):
+    """
+    Historique dans SQLite en mode WAL.
+
+    Pourquoi ?
+    - Une insertion ajoute une ligne au lieu de réécrire tout le fichier.
+    - L'index (user_id, created_at, id) permet de lire l'historique d'un
+      utilisateur, déjà trié, sans parcourir celui des autres.
+    - WAL : les lectures ne bloquent pas pendant une écriture.
+
+    Une connexion par thread (les connexions SQLite ne se partagent pas
+    entre threads).
+    """
+
+    def __init__(self, path: Path):
+        self._path = str(path)
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._path, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            # NORMAL en WAL : pas de fsync à chaque commit, pas de corruption possible
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def add(self, item: Dict[str, str]) -> None:
+        self.add_many([item])
+
+    @timed("history.sqlite.add_many")
+    def add_many(self, items: Iterable[Dict[str, str]]) -> None:
+        rows = [tuple(item[c] for c in _COLUMNS) for item in items]
+        if not rows:
+            return
+        conn = self._conn()
+        # Une seule transaction pour tout le lot ; OR IGNORE rend la migration rejouable
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT OR IGNORE INTO messages (id, user_id, role, content, created_at) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    @timed("history.sqlite.list_for_user")
+    def list_for_user(
+        self, user_id: str, limit: int, offset: int = 0, newest_first: bool = False
+    ) -> List[Dict[str, str]]:
+        direction = "DESC" if newest_first else "ASC"
+        rows = self._conn().execute(
+            "SELECT id, user_id, role, content, created_at FROM messages"
+            f" WHERE user_id = ? ORDER BY created_at {direction}, id {direction} LIMIT ? OFFSET ?",
+            (user_id, limit, offset),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    @timed("history.sqlite.list_page")
+    def list_page(
+        self, user_id: str, limit: int, after: Optional[Cursor] = None, newest_first: bool = False
+    ) -> List[Dict[str, str]]:
+        direction = "DESC" if newest_first else "ASC"
+        sql = "SELECT id, user_id, role, content, created_at FROM messages WHERE user_id = ?"
+        params: list = [user_id]
+        if after is not None:
+            # Comparaison de tuples : parcours direct de l'index à partir du curseur
+            sql += " AND (created_at, id) < (?, ?)" if newest_first else " AND (created_at, id) > (?, ?)"
+            params.extend(after)
+        sql += f" ORDER BY created_at {direction}, id {direction} LIMIT ?"
+        params.append(limit)
+        return [dict(row) for row in self._conn().execute(sql, params).fetchall()]
+
+    @timed("history.sqlite.clear_user")
+    def clear_user(self, user_id: str) -> int:
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN")
+            return conn.execute("DELETE FROM messages WHERE user_id = ?", (user_id,)).rowcount
+
+    def count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def close(self) -> None:
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+# ==========
+# UTILISATEURS (users.json)
+# ==========
+# Écart sous lequel la date de modification de users.json n'est pas fiable
+# (granularité de l'horloge du système de fichiers, jusqu'à 2 s sur certains)
+_RACY_WINDOW_NS = 2_000_000_000
+
+
+class EmailAlreadyRegistered(Exception):
+    """Un compte existe déjà pour cet email (vérifié sous le verrou d'écriture)."""
+
+
+class UserStore:
+    """
+    Table TinyDB "dbuser" avec index en mémoire par id et par email.
+
+    Pourquoi ?
+    - dbuser.get(UserQ.id == ...) parcourt tout users.json à chaque requête
+      authentifiée ; les index rendent ces recherches O(1).
+    - Les écritures de ce processus passent par cette classe : les index
+      restent à jour et les abonnés (cache des tokens) sont prévenus.
+    - Plusieurs workers uvicorn partagent users.json : si le fichier a changé
+      (date de modification / taille), les index sont reconstruits avant la
+      lecture, et les abonnés prévenus des utilisateurs modifiés ailleurs.
+      Coût sur le chemin critique : un os.stat() (plus une relecture dans
+      les 2 s qui suivent une écriture, voir _signature).
+    """
+
+    def __init__(self, path: Path):
+        self._path = path
+        self._db: Optional[TinyDB] = None
+        self._lock = threading.Lock()
+        self._by_id: Dict[str, Dict[str, str]] = {}
+        self._by_email: Dict[str, Dict[str, str]] = {}
+        self._listeners: List[Callable[[str], None]] = []
+        # (mtime_ns, taille) de users.json quand les index ont été construits
+        self._seen: Optional[Tuple[int, int]] = None
+        with self._lock:
+            self._reload_if_changed()
+
+    def _table(self) -> Table:
+        # Appelé avec le verrou déjà pris ; rouvre le fichier après close()
+        if self._db is None:
+            self._db = TinyDB(self._path)
+        return self._db.table("dbuser")
+
+    def _signature(self) -> Optional[Tuple[int, int]]:
+        """
+        (mtime_ns, taille) de users.json, ou None si on ne peut pas s'y fier :
+        une écriture dans la même granularité d'horloge du système de fichiers
+        garderait la même date (et un nouveau hash bcrypt la même taille).
+        Pendant _RACY_WINDOW_NS après une écriture, on relit donc le fichier.
+        """
+        try:
+            st = os.stat(self._path)
+        except FileNotFoundError:
+            return None
+        if time.time_ns() - st.st_mtime_ns < _RACY_WINDOW_NS:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _reload_if_changed(self) -> List[str]:
+        """
+        Appelé avec le verrou déjà pris. Reconstruit les index si users.json a été
+        modifié par un autre processus ; retourne les ids modifiés ou supprimés.
+        """
+        table = self._table()
+        signature = self._signature()
+        if signature is not None and signature == self._seen:
+            return []
+        docs = {doc["id"]: dict(doc) for doc in table.all()}
+        changed = [user_id for user_id, doc in self._by_id.items() if docs.get(user_id) != doc]
+        self._by_id, self._by_email = {}, {}
+        for doc in docs.values():
+            self._index(doc)
+        self._seen = signature
+        return changed
+
+    def _written(self) -> None:
+        # Après une écriture de ce processus (verrou pris) : index déjà à jour
+        self._seen = self._signature()
+
+    def _refresh(self) -> None:
+        signature = self._signature()
+        if signature is not None and signature == self._seen:
+            return
+        with self._lock:
+            changed = self._reload_if_changed()
+        for user_id in changed:
+            self._notify(user_id)
+
+    def _index(self, doc: Dict[str, str]) -> None:
+        self._by_id[doc["id"]] = doc
+        self._by_email[doc["email"]] = doc
+
+    def _notify(self, user_id: str) -> None:
+        for listener in self._listeners:
+            listener(user_id)
+
+    def subscribe(self, listener: Callable[[str], None]) -> None:
+        """listener(user_id) est appelé après chaque modification ou suppression."""
+        self._listeners.append(listener)
+
+    def get_by_id(self, user_id: str) -> Optional[Dict[str, str]]:
+        self._refresh()
+        doc = self._by_id.get(user_id)
+        return dict(doc) if doc else None
+
+    def get_by_email(self, email: str) -> Optional[Dict[str, str]]:
+        self._refresh()
+        doc = self._by_email.get(email)
+        return dict(doc) if doc else None
+
+    @timed("users.insert")
+    def insert(self, doc: Dict[str, str]) -> None:
+        """Lève EmailAlreadyRegistered si l'email est déjà pris."""
+        with self._lock:
+            # Re-vérifié ici, contre le fichier : deux inscriptions simultanées
+            # (ce worker ou un autre) ont pu passer le contrôle de la route
+            # pendant le calcul bcrypt
+            changed = self._reload_if_changed()
+            if doc["email"] in self._by_email:
+                raise EmailAlreadyRegistered(doc["email"])
+            self._table().insert(doc)
+            self._index(dict(doc))
+            self._written()
+        for user_id in changed:
+            self._notify(user_id)
+
+    @timed("users.update")
+    def update(self, user_id: str, fields: Dict[str, str]) -> None:
+        with self._lock:
+            changed = self._reload_if_changed()
+            doc = self._by_id.get(user_id)
+            if doc is not None:
+                self._table().update(fields, Query().id == user_id)
+                updated = {**doc, **fields}
+                self._by_email.pop(doc["email"], None)
+                self._index(updated)
+                self._written()
+                changed.append(user_id)
+        for changed_id in dict.fromkeys(changed):
+            self._notify(changed_id)
+
+    @timed("users.delete")
+    def delete(self, user_id: str) -> bool:
+        with self._lock:
+            changed = self._reload_if_changed()
+            doc = self._by_id.pop(user_id, None)
+            if doc is not None:
+                self._by_email.pop(doc["email"], None)
+                self._table().remove(Query().id == user_id)
+                self._written()
+                changed.append(user_id)
+        for changed_id in dict.fromkeys(changed):
+            self._notify(changed_id)
+        return doc is not None
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+# ==========
+# FABRIQUE
+# ==========
+def open_history_store(bdd_dir: Path) -> HistoryStore:
+    """
+    Ouvre le stockage choisi par HISTORY_BACKEND :
+    - "tinydb" (défaut) : BDD/historique.json
+    - "sqlite"          : BDD/historique.sqlite3 (ou HISTORY_SQLITE_PATH)
+      -> importer l'existant avec : python migrate_history.py
+    """
+    backend = os.getenv("HISTORY_BACKEND", "tinydb").strip().lower()
+    if backend == "tinydb":
+        return TinyDBHistoryStore(bdd_dir / "historique.json")
+    if backend == "sqlite":
+        path = os.getenv("HISTORY_SQLITE_PATH") or str(bdd_dir / "historique.sqlite3")
+        return SQLiteHistoryStore(Path(path))
+    raise RuntimeError(f"Unknown HISTORY_BACKEND: {backend}")
@@ -0,0 +1,21 @@
+"""
+Configuration commune des tests (lancer depuis BackEnd : python -m pytest -q).
+
+Les modules lisent leur configuration à l'import (os.getenv) : on fixe ici
+un environnement de test avant tout import, et main.py écrit dans un
+dossier BDD temporaire.
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+os.environ.setdefault("BDD_DIR", tempfile.mkdtemp(prefix="assistantia-tests-"))
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("OPENROUTER_API_KEY", "test")
+# Jamais d'appel réseau réel depuis les tests
+os.environ.setdefault("OPENROUTER_URL", "http://127.0.0.1:9/api/v1/chat/completions")
+
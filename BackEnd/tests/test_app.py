@@ -0,0 +1,90 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from context import SummaryPostponed
+from ratelimit import ChatLimiter, InMemoryLimiterBackend
+
+
+def _register_and_login(client: TestClient, email: str) -> dict:
+    assert client.post("/auth/register", params={"email": email, "password": "secret"}).status_code == 201
+    response = client.post("/auth/login", params={"email": email, "password": "secret"})
+    assert response.status_code == 200
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def test_history_cursor_pagination():
+    with TestClient(main.app) as client:
+        headers = _register_and_login(client, "cursor@example.com")
+        user_id = client.get("/auth/me", headers=headers).json()["id"]
+        for i in range(5):
+            main.history_store.add({
+                "id": f"msg_{i}", "user_id": user_id, "role": "user", "content": str(i),
+                "created_at": f"2024-01-01T00:00:0{i}+00:00",
+            })
+
+        page = client.get("/history", params={"limit": 3, "order": "desc"}, headers=headers).json()
+        assert [m["content"] for m in page["items"]] == ["4", "3", "2"]
+        params = {"limit": 3, "order": "desc", "cursor": page["next_cursor"]}
+        page = client.get("/history", params=params, headers=headers).json()
+        assert [m["content"] for m in page["items"]] == ["1", "0"]
+        assert page["next_cursor"] is None
+
+        response = client.get("/history", params={"cursor": "garbage"}, headers=headers)
+        assert response.status_code == 400
+
+
+def test_app_survives_lifespan_restart():
+    for i in range(2):
+        with TestClient(main.app) as client:
+            headers = _register_and_login(client, f"restart{i}@example.com")
+            assert client.get("/history", headers=headers).status_code == 200
+
+
+def test_concurrent_registrations_of_one_email():
+    async def scenario():
+        async with main.app.router.lifespan_context(main.app):
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                params = {"email": "race@example.com", "password": "secret"}
+                responses = await asyncio.gather(*(client.post("/auth/register", params=params) for _ in range(5)))
+        return sorted(r.status_code for r in responses)
+
+    assert asyncio.run(scenario()) == [201, 409, 409, 409, 409]
+
+
+def test_zero_rate_returns_429_not_500(monkeypatch):
+    monkeypatch.setattr(main.chat_limiter, "enabled", True)
+    monkeypatch.setattr(main.chat_limiter, "rate", 0.0)
+    monkeypatch.setattr(main.chat_limiter, "burst", 0)
+    with TestClient(main.app) as client:
+        headers = _register_and_login(client, "zero@example.com")
+        response = client.post("/ai/chat", params={"message": "salut"}, headers=headers)
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) > 0
+
+
+def test_context_summary_takes_an_upstream_slot(monkeypatch):
+    limiter = ChatLimiter(InMemoryLimiterBackend(), enabled=True, upstream_max=1)
+    monkeypatch.setattr(main, "chat_limiter", limiter)
+    seen_in_use = []
+
+    async def summarize(previous, turns):
+        seen_in_use.append(await limiter.upstream_in_use())
+        return "résumé"
+
+    monkeypatch.setattr(main, "summarize_turns", summarize)
+
+    async def scenario():
+        busy = await limiter.acquire_upstream()
+        with pytest.raises(SummaryPostponed):
+            await main._summarize_within_limits("", [])
+        await busy.release()
+        assert await main._summarize_within_limits("", []) == "résumé"
+        return await limiter.upstream_in_use()
+
+    assert asyncio.run(scenario()) == 0
+    assert seen_in_use == [1]
@@ -0,0 +1,139 @@
+import asyncio
+import json
+import uuid
+
+import anyio
+import httpx
+
+import main
+from ratelimit import ChatLimiter, InMemoryLimiterBackend
+
+
+def parse_sse(text: str) -> list:
+    """[(event, data), ...] d'un corps text/event-stream."""
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def fake_stream(*deltas, error=None, block=None):
+    async def stream_openrouter(messages, model=None, temperature=None):
+        for delta in deltas:
+            yield delta
+        if block is not None:
+            await block.wait()
+        if error is not None:
+            raise RuntimeError(error)
+
+    return stream_openrouter
+
+
+def new_user() -> dict:
+    user = {
+        "id": f"usr_{uuid.uuid4().hex}",
+        "email": f"{uuid.uuid4().hex}@example.com",
+        "password_hash": "x",
+        "created_at": "2024-01-01T00:00:00+00:00",
+    }
+    main.user_store.insert(user)
+    return user
+
+
+async def post_stream(user: dict) -> httpx.Response:
+    headers = {"Authorization": f"Bearer {main.create_access_token(user['id'])}"}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await client.post("/ai/chat/stream", params={"message": "salut"}, headers=headers)
+
+
+async def saved_history(user: dict) -> list:
+    await main.history_writer.sync_user(user["id"])
+    return [(m["role"], m["content"]) for m in main.history_store.list_page(user["id"], 10)]
+
+
+def test_stream_sends_deltas_then_done(monkeypatch):
+    monkeypatch.setattr(main, "stream_openrouter", fake_stream("Bon", "jour"))
+
+    async def scenario():
+        async with main.app.router.lifespan_context(main.app):
+            user = new_user()
+            response = await post_stream(user)
+            return response, parse_sse(response.text), await saved_history(user)
+
+    response, events, history = asyncio.run(scenario())
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert events[:2] == [("delta", {"content": "Bon"}), ("delta", {"content": "jour"})]
+    assert events[2][0] == "done" and events[2][1]["id"].startswith("msg_")
+    assert history == [("user", "salut"), ("assistant", "Bonjour")]
+
+
+def test_stream_reports_provider_error(monkeypatch):
+    monkeypatch.setattr(main, "stream_openrouter", fake_stream("Bon", error="OpenRouter stream error: boom"))
+
+    async def scenario():
+        async with main.app.router.lifespan_context(main.app):
+            user = new_user()
+            return parse_sse((await post_stream(user)).text), await saved_history(user)
+
+    events, history = asyncio.run(scenario())
+    assert events == [("delta", {"content": "Bon"}), ("error", {"detail": "OpenRouter stream error: boom"})]
+    # La partie déjà envoyée est gardée dans l'historique
+    assert history == [("user", "salut"), ("assistant", "Bon")]
+
+
+def test_partial_answer_saved_on_disconnect(monkeypatch):
+    block = asyncio.Event()
+    monkeypatch.setattr(main, "stream_openrouter", fake_stream("Début", block=block))
+
+    async def scenario():
+        async with main.app.router.lifespan_context(main.app):
+            user = new_user()
+            response = await main.ai_chat_stream("salut", user=user)
+            received = []
+
+            async def client():
+                async for chunk in response.body_iterator:
+                    received.append(chunk)
+
+            # Le client se déconnecte pendant que le modèle génère encore
+            task = asyncio.create_task(client())
+            while not received:
+                await asyncio.sleep(0)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            return received, await saved_history(user)
+
+    received, history = asyncio.run(scenario())
+    assert parse_sse("".join(received)) == [("delta", {"content": "Début"})]
+    assert history == [("user", "salut"), ("assistant", "Début")]
+
+
+class RemoteLikeBackend(InMemoryLimiterBackend):
+    async def release_slot(self, key: str) -> None:
+        await asyncio.sleep(0.001)
+        await super().release_slot(key)
+
+
+def test_disconnect_frees_limiter_slots(monkeypatch):
+    block = asyncio.Event()
+    monkeypatch.setattr(main, "stream_openrouter", fake_stream("Début", block=block))
+    limiter = ChatLimiter(RemoteLikeBackend(), enabled=True, rate_per_minute=600, burst=10, max_inflight=1)
+    monkeypatch.setattr(main, "chat_limiter", limiter)
+
+    async def scenario():
+        async with main.app.router.lifespan_context(main.app):
+            user = new_user()
+            response = await main.ai_chat_stream("salut", user=user)
+            # Déconnexion telle que Starlette la produit : annulation d'anyio
+            with anyio.CancelScope() as scope:
+                async for _ in response.body_iterator:
+                    scope.cancel()
+            await asyncio.sleep(0.05)
+            assert await limiter.backend.slots_in_use(f"inflight:{user['id']}") == 0
+            assert await limiter.upstream_in_use() == 0
+            # La requête suivante n'est pas refusée (429 "Too many concurrent requests")
+            await (await limiter.acquire(user["id"])).release()
+
+    asyncio.run(scenario())
@@ -0,0 +1,122 @@
+import asyncio
+import threading
+
+import pytest
+
+from history_writer import HistoryWriter
+from storage import SQLiteHistoryStore
+
+
+def message(user_id: str, i: int) -> dict:
+    return {
+        "id": f"msg_{i:04d}",
+        "user_id": user_id,
+        "role": "user",
+        "content": f"message {i}",
+        "created_at": f"2024-01-01T00:00:00.{i:06d}+00:00",
+    }
+
+
+class RecordingStore(SQLiteHistoryStore):
+    """Note les lots écrits et le thread qui les écrit."""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.batches = []
+        self.threads = set()
+
+    def add_many(self, items):
+        items = list(items)
+        self.batches.append(len(items))
+        self.threads.add(threading.get_ident())
+        super().add_many(items)
+
+
+@pytest.fixture
+def store(tmp_path):
+    s = RecordingStore(tmp_path / "historique.sqlite3")
+    yield s
+    s.close()
+
+
+def ids(store, user_id="u"):
+    return [item["id"] for item in store.list_page(user_id, 1000)]
+
+
+def test_async_mode_batches_and_flushes(store):
+    async def scenario():
+        writer = HistoryWriter(store, mode="async", flush_interval=10)
+        await writer.start()
+        for i in range(5):
+            await writer.write(message("u", i))
+        assert writer.queued == 5
+        # Lecture de ses propres écritures : sync_user n'attend pas l'intervalle
+        await asyncio.wait_for(writer.sync_user("u"), timeout=1)
+        assert ids(store) == [f"msg_{i:04d}" for i in range(5)]
+        assert writer.queued == 0
+        await writer.stop()
+
+    asyncio.run(scenario())
+    assert store.batches == [5]
+
+
+def test_stop_writes_remaining_messages(store):
+    async def scenario():
+        writer = HistoryWriter(store, mode="async", flush_interval=10)
+        await writer.start()
+        await writer.write(message("u", 1))
+        writer.write_nowait(message("u", 2))
+        await writer.stop()
+        assert not writer.running
+        # Après l'arrêt, les écritures passent directement par le stockage
+        await writer.write(message("u", 3))
+        await writer.stop()
+
+    asyncio.run(scenario())
+    assert ids(store) == ["msg_0001", "msg_0002", "msg_0003"]
+
+
+def test_group_mode_waits_for_commit(store):
+    async def scenario():
+        writer = HistoryWriter(store, mode="group", flush_interval=0.01)
+        await writer.start()
+        await asyncio.gather(*(writer.write(message("u", i)) for i in range(10)))
+        # Chaque write() est revenu après son commit
+        assert len(ids(store)) == 10
+        await writer.stop()
+
+    asyncio.run(scenario())
+    assert len(store.batches) < 10
+
+
+def test_request_mode_write_nowait_runs_off_loop(store):
+    async def scenario():
+        writer = HistoryWriter(store, mode="request")
+        await writer.start()
+        loop_thread = threading.get_ident()
+        writer.write_nowait(message("u", 1))
+        assert writer.queued == 1
+        await writer.sync_user("u")
+        assert ids(store) == ["msg_0001"]
+        assert loop_thread not in store.threads
+        await writer.stop()
+
+    asyncio.run(scenario())
+
+
+def test_sync_user_ignores_other_users(store):
+    async def scenario():
+        writer = HistoryWriter(store, mode="async", flush_interval=10)
+        await writer.start()
+        await writer.write(message("other", 1))
+        await asyncio.wait_for(writer.sync_user("u"), timeout=0.1)
+        assert ids(store, "other") == []
+        await writer.stop()
+        assert ids(store, "other") == ["msg_0001"]
+
+    asyncio.run(scenario())
+
+
+def test_unknown_mode_rejected(store):
+    with pytest.raises(RuntimeError):
+        HistoryWriter(store, mode="eventually")
@@ -0,0 +1,111 @@
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import httpx
+import pytest
+
+import llm
+
+
+def response(status: int, retry_after=None) -> httpx.Response:
+    headers = {"Retry-After": retry_after} if retry_after is not None else {}
+    return httpx.Response(status, headers=headers)
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setenv("OPENROUTER_RETRY_BASE_DELAY", "0")
+    monkeypatch.setenv("OPENROUTER_MAX_RETRIES", "2")
+
+
+def run_with_upstream(monkeypatch, replies, coro_factory):
+    """Exécute coro_factory() avec un client dont les réponses sont rejouées dans l'ordre."""
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        reply = replies[min(len(requests), len(replies)) - 1]
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    async def scenario():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        monkeypatch.setattr(llm, "_client", client)
+        try:
+            return await coro_factory()
+        finally:
+            await client.aclose()
+
+    return asyncio.run(scenario()), requests
+
+
+def completion(text: str) -> httpx.Response:
+    return httpx.Response(200, json={"choices": [{"message": {"content": text}}], "usage": {"prompt_tokens": 3}})
+
+
+def sse(*deltas: str) -> httpx.Response:
+    lines = [": OPENROUTER PROCESSING"]
+    lines += [f"data: {json.dumps({'choices': [{'delta': {'content': d}}]})}" for d in deltas]
+    lines.append("data: [DONE]")
+    return httpx.Response(200, text="\n\n".join(lines) + "\n\n", headers={"Content-Type": "text/event-stream"})
+
+
+def test_retry_after_seconds_and_http_date():
+    assert llm._retry_after_seconds(response(429, "3")) == 3.0
+    assert llm._retry_after_seconds(response(429, "-5")) == 0.0
+    assert llm._retry_after_seconds(response(429)) is None
+    assert llm._retry_after_seconds(response(429, "soon")) is None
+    when = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    assert 25 < llm._retry_after_seconds(response(503, when)) <= 30
+
+
+def test_retry_delay_honors_header_and_jitters(monkeypatch):
+    assert llm._retry_delay(0, response(429, "2")) == 2.0
+    # Au-delà du délai max : pas de nouvel essai anticipé
+    assert llm._retry_delay(0, response(429, "60")) is None
+    monkeypatch.setenv("OPENROUTER_RETRY_BASE_DELAY", "1")
+    monkeypatch.setenv("OPENROUTER_RETRY_MAX_DELAY", "4")
+    for attempt in range(5):
+        delay = llm._retry_delay(attempt)
+        assert 0 <= delay <= min(4, 2 ** attempt)
+
+
+def test_send_retries_before_first_byte(monkeypatch):
+    answer, requests = run_with_upstream(
+        monkeypatch,
+        [response(503), httpx.ConnectError("refused"), completion("bonjour")],
+        lambda: llm.call_openrouter([{"role": "user", "content": "salut"}]),
+    )
+    assert answer == "bonjour"
+    assert len(requests) == 3
+
+
+def test_send_gives_up_after_max_retries(monkeypatch):
+    with pytest.raises(RuntimeError, match="OpenRouter error: 502"):
+        run_with_upstream(monkeypatch, [response(502)], lambda: llm.call_openrouter([]))
+
+
+def test_long_retry_after_is_not_retried_early(monkeypatch):
+    async def call():
+        with pytest.raises(RuntimeError, match="OpenRouter error: 429"):
+            await llm.call_openrouter([])
+
+    _, requests = run_with_upstream(monkeypatch, [response(429, "60"), completion("jamais")], call)
+    assert len(requests) == 1
+
+
+def test_non_retryable_status_is_not_retried(monkeypatch):
+    with pytest.raises(RuntimeError, match="400"):
+        run_with_upstream(monkeypatch, [response(400), completion("jamais")], lambda: llm.call_openrouter([]))
+
+
+def test_stream_retries_then_yields_deltas(monkeypatch):
+    async def collect():
+        return [delta async for delta in llm.stream_openrouter([{"role": "user", "content": "salut"}])]
+
+    deltas, requests = run_with_upstream(monkeypatch, [response(429, "0"), sse("Bon", "jour")], collect)
+    assert deltas == ["Bon", "jour"]
+    assert len(requests) == 2
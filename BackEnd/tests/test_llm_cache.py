@@ -0,0 +1,48 @@
+import asyncio
+
+from llm import default_temperature
+from llm_cache import CompletionCache, DiskTier
+
+
+def test_disk_tier_keeps_running_total_and_evicts_in_batch(tmp_path):
+    disk = DiskTier(tmp_path / "cache.sqlite3", max_bytes=1000, ttl=60)
+    for i in range(10):
+        disk.put(f"k{i}", "x" * 100)
+    assert disk.total_bytes == 1000
+
+    disk.put("k10", "x" * 100)
+    # Un lot d'évictions, jusqu'à 90 % du maximum, en commençant par les plus anciennes
+    assert disk.total_bytes <= 900
+    assert disk.get("k0") is None and disk.get("k1") is None
+    assert disk.get("k10") is not None
+
+    disk.put("k10", "y")
+    assert disk.total_bytes == disk._sum_sizes(disk._conn)
+    disk.close()
+    # Rouvert à la demande (redémarrage de l'application)
+    assert disk.get("k10")[0] == "y"
+    disk.close()
+
+
+def test_completion_cache_disk_promotion(tmp_path):
+    cache = CompletionCache(enabled=True, max_temperature=0.5, disk_path=str(tmp_path / "cache.sqlite3"))
+    messages = [{"role": "user", "content": "Bonjour  ?"}]
+    key = cache.key_for("m", 0.0, messages)
+    assert cache.key_for("m", 0.0, [{"role": "user", "content": "bonjour"}]) == key
+    assert cache.key_for("m", 0.9, messages) is None
+
+    async def scenario():
+        await cache.put(key, "salut")
+        cache.memory._entries.clear()
+        assert await cache.get(key) == "salut"
+        assert len(cache.memory) == 1
+
+    asyncio.run(scenario())
+    cache.close()
+
+
+def test_default_temperature_bypasses_cache():
+    cache = CompletionCache(enabled=True)
+    messages = [{"role": "user", "content": "salut"}]
+    assert cache.key_for("m", default_temperature(), messages) is None
+    assert cache.key_for("m", 0.0, messages) is not None
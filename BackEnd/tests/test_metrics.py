@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+import metrics
+from metrics import Counter, Gauge, Histogram, Registry, _Metric, record_llm_usage
+
+
+def samples(text: str) -> dict:
+    """{nom{labels}: valeur} des lignes non commentées."""
+    return dict(line.rsplit(" ", 1) for line in text.splitlines() if line and not line.startswith("#"))
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    hist = registry.register(Histogram("op_seconds", "Durée", ("op",), buckets=(0.1, 1.0)))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        hist.observe(value, "read")
+
+    text = registry.render()
+    assert "# HELP op_seconds Durée\n# TYPE op_seconds histogram\n" in text
+    values = samples(text)
+    assert values['op_seconds_bucket{op="read",le="0.1"}'] == "2"
+    assert values['op_seconds_bucket{op="read",le="1"}'] == "3"
+    assert values['op_seconds_bucket{op="read",le="+Inf"}'] == "4"
+    assert values['op_seconds_count{op="read"}'] == "4"
+    assert float(values['op_seconds_sum{op="read"}']) == 3.65
+
+
+def test_counter_gauge_and_label_escaping():
+    registry = Registry()
+    counter = registry.register(Counter("events_total", "Évènements", ("kind",)))
+    counter.inc('a"b\\c')
+    counter.inc('a"b\\c', amount=2)
+    registry.register(Gauge("queue_depth", "Profondeur", lambda: 7))
+    registry.register(Gauge("broken", "Lecture impossible", lambda: 1 / 0))
+
+    values = samples(registry.render())
+    assert values['events_total{kind="a\\"b\\\\c"}'] == "3"
+    assert values["queue_depth"] == "7"
+    assert "broken" not in values
+
+
+def test_async_gauge_is_awaited_by_render_async():
+    registry = Registry()
+    reads = []
+
+    async def in_use():
+        reads.append(1)
+        return 3
+
+    registry.register(Gauge("slots_in_use", "Places occupées", in_use))
+    registry.register(Gauge("queue_depth", "Profondeur", lambda: 7))
+
+    values = samples(asyncio.run(registry.render_async()))
+    assert values == {"slots_in_use": "3", "queue_depth": "7"}
+    # render() synchrone ne peut pas attendre la lecture : la jauge est omise
+    assert "slots_in_use" not in samples(registry.render())
+    assert len(reads) == 1
+
+
+def test_metric_base_is_abstract():
+    with pytest.raises(TypeError):
+        _Metric("m", "aide")
+
+
+def test_record_llm_usage(monkeypatch):
+    tokens = Counter("llm_tokens_total", "Tokens", ("model", "type"))
+    monkeypatch.setattr(metrics, "LLM_TOKENS", tokens)
+    record_llm_usage("m", {"prompt_tokens": 12, "completion_tokens": 30, "total_tokens": 42})
+    record_llm_usage("m", {"prompt_tokens": 3})
+    record_llm_usage("m", None)
+    values = samples("\n".join(tokens.render()))
+    assert values['llm_tokens_total{model="m",type="prompt"}'] == "15"
+    assert values['llm_tokens_total{model="m",type="completion"}'] == "30"
+
+
+def test_metrics_endpoint_uses_route_templates():
+    in_use_gauge = metrics.REGISTRY._metrics["upstream_slots_in_use"]
+    with TestClient(main.app) as client:
+        client.get("/")
+        client.get("/does-not-exist")
+        response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    values = samples(response.text)
+    assert any(k.startswith('http_request_duration_seconds_count{method="GET",route="/",status="200"}') for k in values)
+    assert any('route="unmatched",status="404"' in k for k in values)
+    assert "upstream_slots_in_use" in values
+    # Jauge enregistrée une fois au démarrage, pas à chaque export
+    assert metrics.REGISTRY._metrics["upstream_slots_in_use"] is in_use_gauge
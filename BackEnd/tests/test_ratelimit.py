@@ -0,0 +1,141 @@
+import asyncio
+import math
+
+import anyio
+import pytest
+
+from ratelimit import MAX_RETRY_AFTER, ChatLimiter, InMemoryLimiterBackend, RateLimitExceeded
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def limiter(**kwargs) -> ChatLimiter:
+    options = dict(enabled=True, rate_per_minute=60, burst=2, max_inflight=2, upstream_max=1)
+    options.update(kwargs)
+    return ChatLimiter(InMemoryLimiterBackend(), **options)
+
+
+def test_burst_then_rate_limited():
+    async def scenario():
+        chat = limiter()
+        for _ in range(2):
+            await (await chat.acquire("u")).release()
+        with pytest.raises(RateLimitExceeded) as exc:
+            await chat.acquire("u")
+        assert 0 < exc.value.retry_after <= 1
+        # Les autres utilisateurs ont leur propre seau
+        await (await chat.acquire("v")).release()
+
+    run(scenario())
+
+
+def test_zero_rate_gives_finite_retry_after():
+    async def scenario():
+        chat = limiter(rate_per_minute=0, burst=1)
+        await (await chat.acquire("u")).release()
+        with pytest.raises(RateLimitExceeded) as exc:
+            await chat.acquire("u")
+        assert exc.value.retry_after == MAX_RETRY_AFTER
+        assert math.ceil(exc.value.retry_after) == MAX_RETRY_AFTER
+
+    run(scenario())
+
+
+def test_inflight_limit_and_idempotent_release():
+    async def scenario():
+        chat = limiter(burst=10)
+        first = await chat.acquire("u")
+        second = await chat.acquire("u")
+        with pytest.raises(RateLimitExceeded):
+            await chat.acquire("u")
+        await first.release()
+        await first.release()
+        third = await chat.acquire("u")
+        await second.release()
+        await third.release()
+        assert await chat.backend.slots_in_use("inflight:u") == 0
+
+    run(scenario())
+
+
+def test_rejected_inflight_does_not_consume_token():
+    async def scenario():
+        chat = limiter(burst=1, max_inflight=1)
+        lease = await chat.acquire("u")
+        with pytest.raises(RateLimitExceeded):
+            await chat.acquire("u")
+        await lease.release()
+        # Le seau était vide après la première requête : c'est bien le débit qui bloque
+        with pytest.raises(RateLimitExceeded, match="Rate limit"):
+            await chat.acquire("u")
+
+    run(scenario())
+
+
+def test_upstream_slot_reserved_only_on_demand():
+    async def scenario():
+        chat = limiter(burst=10)
+        hit = await chat.acquire("u")
+        miss = await chat.acquire("v")
+        assert await chat.upstream_in_use() == 0
+
+        await miss.acquire_upstream()
+        await miss.acquire_upstream()  # déjà réservée : sans effet
+        assert await chat.upstream_in_use() == 1
+        with pytest.raises(RateLimitExceeded, match="busy"):
+            await hit.acquire_upstream()
+
+        await miss.release()
+        await hit.release()
+        assert await chat.upstream_in_use() == 0
+
+    run(scenario())
+
+
+def test_disabled_limiter_never_rejects():
+    async def scenario():
+        chat = limiter(enabled=False, burst=0, max_inflight=0, upstream_max=0)
+        lease = await chat.acquire("u")
+        await lease.acquire_upstream()
+        await lease.release()
+
+    run(scenario())
+
+
+class RemoteLikeBackend(InMemoryLimiterBackend):
+    """Backend dont les opérations rendent la main à la boucle (comme un Redis)."""
+
+    async def release_slot(self, key: str) -> None:
+        await asyncio.sleep(0.001)
+        await super().release_slot(key)
+
+
+def test_release_completes_when_task_is_cancelled():
+    chat = ChatLimiter(RemoteLikeBackend(), enabled=True, rate_per_minute=60, burst=10, max_inflight=1, upstream_max=1)
+
+    async def scenario():
+        lease = await chat.acquire("u")
+        await lease.acquire_upstream()
+
+        async def handler():
+            try:
+                await asyncio.Event().wait()
+            finally:
+                await lease.release()
+
+        # Annulation "en niveau" comme celle d'anyio/Starlette : chaque await
+        # de la tâche annulée relève CancelledError
+        with anyio.CancelScope() as scope:
+            async with anyio.create_task_group() as tg:
+                tg.start_soon(handler)
+                await asyncio.sleep(0.01)
+                scope.cancel()
+        await lease.release()
+        assert await chat.backend.slots_in_use("inflight:u") == 0
+        assert await chat.upstream_in_use() == 0
+        # La requête suivante de l'utilisateur passe
+        await (await chat.acquire("u")).release()
+
+    run(scenario())
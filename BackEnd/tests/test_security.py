@@ -0,0 +1,100 @@
+import asyncio
+import threading
+
+import pytest
+
+import security
+from security import (
+    PasswordHasher,
+    PasswordHasherBusy,
+    TokenCache,
+    get_password_hasher,
+    needs_rehash,
+    shutdown_password_hasher,
+)
+
+
+def test_needs_rehash():
+    current = security.hash_password("secret")
+    assert not needs_rehash(current)
+    assert needs_rehash("$2b$05$" + current.split("$")[3])
+    assert not needs_rehash("not-a-bcrypt-hash")
+
+
+def test_password_hasher_rejects_when_queue_full():
+    hasher = PasswordHasher(max_workers=1, max_pending=1)
+    gate = threading.Event()
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        blocked = asyncio.ensure_future(hasher._run(gate.wait))
+        await asyncio.sleep(0)
+        assert hasher.pending == 1
+        with pytest.raises(PasswordHasherBusy):
+            await hasher.hash("secret")
+        gate.set()
+        await blocked
+        assert hasher.pending == 0
+        assert await hasher.verify("secret", await loop.run_in_executor(None, security.hash_password, "secret"))
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        hasher.shutdown()
+
+
+def test_password_hasher_recreated_after_shutdown():
+    async def roundtrip() -> bool:
+        password_hash = await get_password_hasher().hash("secret")
+        return await get_password_hasher().verify("secret", password_hash)
+
+    assert asyncio.run(roundtrip())
+    shutdown_password_hasher()
+    assert asyncio.run(roundtrip())
+    shutdown_password_hasher()
+
+
+class Clock:
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_token_cache_respects_ttl_and_token_exp(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(security.time, "time", clock)
+    cache = TokenCache(max_size=10, ttl=60)
+
+    cache.put("a", "u1", {"id": "u1"}, exp=int(clock.now) + 3600)
+    cache.put("b", "u1", {"id": "u1"}, exp=int(clock.now) + 10)
+    clock.now += 11
+    assert cache.get("a") == {"id": "u1"}
+    assert cache.get("b") is None  # jamais servi après le "exp" du token
+    clock.now += 60
+    assert cache.get("a") is None  # TTL du cache
+    assert len(cache) == 0
+
+
+def test_token_cache_lru_eviction():
+    cache = TokenCache(max_size=2, ttl=60)
+    exp = 2 ** 40
+    cache.put("a", "u1", {"id": "u1"}, exp)
+    cache.put("b", "u2", {"id": "u2"}, exp)
+    cache.get("a")
+    cache.put("c", "u3", {"id": "u3"}, exp)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+
+
+def test_token_cache_invalidate_user():
+    cache = TokenCache(max_size=10, ttl=60)
+    exp = 2 ** 40
+    cache.put("a", "u1", {"id": "u1"}, exp)
+    cache.put("b", "u1", {"id": "u1"}, exp)
+    cache.put("c", "u2", {"id": "u2"}, exp)
+    cache.invalidate_user("u1")
+    assert cache.get("a") is None and cache.get("b") is None
+    assert cache.get("c") is not None
+    cache.invalidate_user("unknown")
@@ -0,0 +1,142 @@
+import base64
+
+import pytest
+
+from storage import (
+    EmailAlreadyRegistered,
+    SQLiteHistoryStore,
+    TinyDBHistoryStore,
+    UserStore,
+    decode_cursor,
+    encode_cursor,
+)
+
+
+def message(user_id: str, i: int) -> dict:
+    return {
+        "id": f"msg_{i:04d}",
+        "user_id": user_id,
+        "role": "user",
+        "content": f"message {i}",
+        # Même horodatage pour tout le monde : l'id départage
+        "created_at": "2024-01-01T00:00:00+00:00" if i % 2 else f"2024-01-01T00:00:{i:02d}+00:00",
+    }
+
+
+@pytest.fixture(params=["tinydb", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "tinydb":
+        s = TinyDBHistoryStore(tmp_path / "historique.json")
+    else:
+        s = SQLiteHistoryStore(tmp_path / "historique.sqlite3")
+    yield s
+    s.close()
+
+
+def test_list_for_user_orders_and_isolates_users(store):
+    store.add_many(message("u", i) for i in range(6))
+    store.add(message("other", 99))
+    oldest_first = [item["id"] for item in store.list_for_user("u", limit=10)]
+    assert oldest_first == ["msg_0000", "msg_0001", "msg_0003", "msg_0005", "msg_0002", "msg_0004"]
+    assert [item["id"] for item in store.list_for_user("u", limit=2, offset=1, newest_first=True)] == [
+        "msg_0002", "msg_0005",
+    ]
+    assert store.clear_user("u") == 6
+    assert store.list_for_user("u", limit=10) == []
+    assert len(store.list_for_user("other", limit=10)) == 1
+
+
+def test_store_reopens_after_close(store):
+    store.add(message("u", 1))
+    store.close()
+    store.add(message("u", 2))
+    assert [item["id"] for item in store.list_for_user("u", limit=10)] == ["msg_0001", "msg_0002"]
+    assert store.clear_user("u") == 2
+
+
+def test_cursor_roundtrip():
+    item = message("u", 3)
+    assert decode_cursor(encode_cursor(item)) == (item["created_at"], item["id"])
+
+
+@pytest.mark.parametrize("cursor", [
+    "",
+    "%%%",
+    base64.urlsafe_b64encode(b"not json").decode(),
+    base64.urlsafe_b64encode(b'{"a": 1}').decode(),
+    base64.urlsafe_b64encode(b'["only-one"]').decode(),
+    base64.urlsafe_b64encode(b'[1, 2]').decode(),
+])
+def test_decode_cursor_rejects_foreign_input(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+@pytest.mark.parametrize("newest_first", [False, True])
+def test_list_page_walks_every_message_once(store, newest_first):
+    store.add_many(message("u", i) for i in range(25))
+    store.add(message("other", 99))
+
+    seen, after = [], None
+    while True:
+        page = store.list_page("u", 7, after=after, newest_first=newest_first)
+        seen.extend(item["id"] for item in page)
+        if len(page) < 7:
+            break
+        after = decode_cursor(encode_cursor(page[-1]))
+
+    expected = [item["id"] for item in store.list_for_user("u", limit=100, newest_first=newest_first)]
+    assert seen == expected
+    assert len(seen) == 25
+
+
+def test_user_store_rejects_duplicate_email(tmp_path):
+    users = UserStore(tmp_path / "users.json")
+    doc = {"id": "usr_1", "email": "a@example.com", "password_hash": "x", "created_at": "now"}
+    users.insert(doc)
+    with pytest.raises(EmailAlreadyRegistered):
+        users.insert({**doc, "id": "usr_2"})
+    assert users.get_by_email("a@example.com")["id"] == "usr_1"
+    assert users.get_by_id("usr_2") is None
+
+    users.close()
+    # Rouvert à la demande, index conservés
+    users.update("usr_1", {"password_hash": "y"})
+    users.close()
+    assert UserStore(tmp_path / "users.json").get_by_id("usr_1")["password_hash"] == "y"
+
+
+def test_user_store_notifies_listeners(tmp_path):
+    users = UserStore(tmp_path / "users.json")
+    changed = []
+    users.subscribe(changed.append)
+    users.insert({"id": "usr_1", "email": "a@example.com", "password_hash": "x", "created_at": "now"})
+    users.update("usr_1", {"email": "b@example.com"})
+    assert users.get_by_email("a@example.com") is None
+    assert users.delete("usr_1")
+    assert not users.delete("usr_1")
+    assert changed == ["usr_1", "usr_1"]
+    users.close()
+
+
+def test_user_store_sees_writes_from_another_worker(tmp_path):
+    # Deux workers uvicorn = deux UserStore sur le même fichier
+    worker_a = UserStore(tmp_path / "users.json")
+    worker_b = UserStore(tmp_path / "users.json")
+    changed = []
+    worker_b.subscribe(changed.append)
+
+    worker_a.insert({"id": "usr_1", "email": "a@example.com", "password_hash": "x", "created_at": "now"})
+    assert worker_b.get_by_id("usr_1")["email"] == "a@example.com"
+    with pytest.raises(EmailAlreadyRegistered):
+        worker_b.insert({"id": "usr_2", "email": "a@example.com", "password_hash": "x", "created_at": "now"})
+
+    worker_a.update("usr_1", {"password_hash": "y"})
+    assert worker_b.get_by_email("a@example.com")["password_hash"] == "y"
+    assert changed == ["usr_1"]  # le cache des tokens de B est invalidé
+
+    worker_a.delete("usr_1")
+    assert worker_b.get_by_id("usr_1") is None
+    assert changed == ["usr_1", "usr_1"]
+    worker_a.close()
+    worker_b.close()